@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark.
+
+Repeatedly stops a project and starts it again through the gateway, against
+the fake service manager, and measures how long POST /projects/{name}/start
+takes to return a ready port and how long the first proxied request after it
+takes. Use --startup-delay to simulate OpenCode's own boot time; the rest is
+gateway, service manager and port discovery.
+
+Usage:
+    python bench_cold_start.py --iterations 20
+    python bench_cold_start.py --startup-delay 1.5
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+from harness import Gateway, format_ms, summarize_ms
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument(
+        "--startup-delay",
+        type=float,
+        default=0.0,
+        help="Seconds the mock OpenCode waits before listening",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    return parser.parse_args(argv)
+
+
+async def run(options: argparse.Namespace) -> dict:
+    start_ms: list[float] = []
+    first_request_ms: list[float] = []
+    errors = 0
+
+    opencode_args = f"--startup-delay {options.startup_delay}"
+    async with Gateway(projects=1, opencode_args=opencode_args) as gateway:
+        project = gateway.projects[0]
+        base = f"{gateway.url}/projects/{project}"
+        async with httpx.AsyncClient(timeout=120.0) as client:
+            for _ in range(options.iterations):
+                await client.delete(
+                    f"{base}/stop", params={"drain": "false"}, headers=gateway.headers
+                )
+
+                started = time.perf_counter()
+                response = await client.post(f"{base}/start", headers=gateway.headers)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                ready = time.perf_counter()
+                response = await client.get(
+                    f"{base}/api/session", headers=gateway.headers
+                )
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                start_ms.append((ready - started) * 1000)
+                first_request_ms.append((time.perf_counter() - ready) * 1000)
+
+    return {
+        "benchmark": "cold_start",
+        "parameters": {
+            "iterations": options.iterations,
+            "startup_delay": options.startup_delay,
+        },
+        "scenarios": {
+            "start": {"errors": errors, **summarize_ms(start_ms)},
+            "first_request": {"errors": errors, **summarize_ms(first_request_ms)},
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    params = report["parameters"]
+    print(
+        f"{params['iterations']} cold starts, "
+        f"mock startup delay {params['startup_delay']:g}s"
+    )
+    print(f"{'phase':<14} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<14} {format_ms(result['p50_ms']):>9} "
+            f"{format_ms(result['p95_ms']):>9} {format_ms(result['p99_ms']):>9} "
+            f"{format_ms(result['max_ms']):>9}"
+        )
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["scenarios"]["start"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Project listing benchmark.
+
+Starts a gateway whose HOME_DIR holds many project directories (some of
+them running) and measures GET /projects and GET /projects/{name}/status
+latency.
+
+Usage:
+    python bench_projects.py --projects 200 --running 5 --requests 50
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+from harness import Gateway, format_ms, summarize_ms
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--projects", type=int, default=100, help="Project directories")
+    parser.add_argument("--running", type=int, default=3, help="Projects started")
+    parser.add_argument(
+        "--requests", type=int, default=30, help="Requests per endpoint"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Concurrent requests"
+    )
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    return parser.parse_args(argv)
+
+
+async def measure(
+    client: httpx.AsyncClient, url: str, headers: dict, requests: int, concurrency: int
+) -> dict:
+    latencies_ms: list[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        **summarize_ms(latencies_ms),
+    }
+
+
+async def run(options: argparse.Namespace) -> dict:
+    gateway = Gateway(projects=options.projects)
+    gateway.start()
+    try:
+        # Startup scans every project directory
+        await gateway.wait_ready(timeout=30 + options.projects * 0.5)
+        async with httpx.AsyncClient(timeout=300.0) as client:
+            for project in gateway.projects[: options.running]:
+                await gateway.start_project(project, client)
+
+            scenarios = {
+                "list": f"{gateway.url}/projects",
+                "status": f"{gateway.url}/projects/{gateway.projects[0]}/status",
+            }
+            results = {
+                name: await measure(
+                    client, url, gateway.headers, options.requests, options.concurrency
+                )
+                for name, url in scenarios.items()
+            }
+    finally:
+        gateway.stop()
+
+    return {
+        "benchmark": "projects",
+        "parameters": {
+            "projects": options.projects,
+            "running": options.running,
+            "requests": options.requests,
+            "concurrency": options.concurrency,
+        },
+        "scenarios": results,
+    }
+
+
+def print_report(report: dict) -> None:
+    params = report["parameters"]
+    print(
+        f"{params['projects']} project directories, {params['running']} running, "
+        f"concurrency {params['concurrency']}"
+    )
+    print(
+        f"{'endpoint':<8} {'requests':>9} {'errors':>7} "
+        f"{'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    )
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<8} {result['requests']:>9} {result['errors']:>7} "
+            f"{format_ms(result['p50_ms']):>9} {format_ms(result['p95_ms']):>9} "
+            f"{format_ms(result['p99_ms']):>9} {format_ms(result['max_ms']):>9}"
+        )
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = any(r["errors"] for r in report["scenarios"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
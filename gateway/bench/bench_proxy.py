@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Proxy throughput and latency benchmark.
+
+Starts a gateway wired to the fake service manager, starts one mock OpenCode
+instance through it and drives closed-loop load (N concurrent clients, each
+sending its next request when the previous one completes) at:
+
+    direct GET   the mock instance itself (baseline without the gateway)
+    proxy GET    /projects/{name}/api/config
+    proxy POST   /projects/{name}/api/bench/echo with a JSON body
+
+For every scenario it reports throughput, latency p50/p95/p99 and, for the
+proxied ones, gateway overhead (Server-Timing total minus time spent in
+OpenCode). Server-Timing only covers the time inside the application, not
+HTTP parsing or waiting for the event loop, so the cost of the gateway is
+the proxy GET measured against the direct GET: latency added at p50/p95 and
+the ratio of their throughputs.
+
+With --unix-sockets the instance listens on a Unix socket and both the
+gateway and the direct scenario reach it over that.
+
+Usage:
+    python bench_proxy.py --concurrency 32 --duration 10
+    python bench_proxy.py --unix-sockets
+    python bench_proxy.py --latency-ms 20 --payload-bytes 65536 --json out.json
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+
+from harness import Gateway, format_ms, gateway_overhead_ms, summarize_ms
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds per scenario"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=1.0, help="Unmeasured seconds per scenario"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="Mock OpenCode response delay"
+    )
+    parser.add_argument(
+        "--payload-bytes", type=int, default=1024, help="Mock response size"
+    )
+    parser.add_argument("--post-bytes", type=int, default=1024, help="POST body size")
+    parser.add_argument(
+        "--unix-sockets",
+        action="store_true",
+        help="Run the instance on a Unix socket instead of a TCP port",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=("direct-get", "proxy-get", "proxy-post"),
+        help="Run only these scenarios (repeatable)",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    return parser.parse_args(argv)
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    headers: dict,
+    body: bytes | None,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+) -> dict:
+    """Closed-loop load; returns throughput, latency and overhead statistics."""
+    latencies_ms: list[float] = []
+    overheads_ms: list[float] = []
+    errors = 0
+    measuring = False
+
+    async def worker(deadline: float) -> None:
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, url, headers=headers, content=body
+                )
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+                response = None
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if not measuring:
+                continue
+            if not ok:
+                errors += 1
+                continue
+            latencies_ms.append(elapsed_ms)
+            overhead = gateway_overhead_ms(response.headers.get("server-timing", ""))
+            if overhead is not None:
+                overheads_ms.append(overhead)
+
+    if warmup:
+        await asyncio.gather(
+            *(worker(time.monotonic() + warmup) for _ in range(concurrency))
+        )
+
+    measuring = True
+    start = time.monotonic()
+    await asyncio.gather(*(worker(start + duration) for _ in range(concurrency)))
+    elapsed = time.monotonic() - start
+
+    result = {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "rps": len(latencies_ms) / elapsed,
+        **summarize_ms(latencies_ms),
+    }
+    if overheads_ms:
+        result["overhead"] = summarize_ms(overheads_ms)
+    return result
+
+
+async def run(options: argparse.Namespace) -> dict:
+    scenarios = options.scenario or ["direct-get", "proxy-get", "proxy-post"]
+    opencode_args = (
+        f"--latency-ms {options.latency_ms} --payload-bytes {options.payload_bytes}"
+    )
+    post_body = json.dumps({"data": "x" * options.post_bytes}).encode()
+    results = {}
+
+    gateway = Gateway(
+        projects=1, opencode_args=opencode_args, unix_sockets=options.unix_sockets
+    )
+    async with gateway:
+        project = gateway.projects[0]
+        limits = httpx.Limits(
+            max_connections=options.concurrency,
+            max_keepalive_connections=options.concurrency,
+        )
+        async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+            address = await gateway.start_project(project, client)
+            if isinstance(address, str):
+                direct = httpx.AsyncClient(
+                    timeout=30.0,
+                    transport=httpx.AsyncHTTPTransport(uds=address, limits=limits),
+                )
+                direct_url = "http://localhost/config"
+            else:
+                direct = client
+                direct_url = f"http://127.0.0.1:{address}/config"
+            api = f"{gateway.url}/projects/{project}/api"
+            requests = {
+                "direct-get": (direct, "GET", direct_url, None),
+                "proxy-get": (client, "GET", f"{api}/config", None),
+                "proxy-post": (client, "POST", f"{api}/bench/echo", post_body),
+            }
+            json_headers = {**gateway.headers, "Content-Type": "application/json"}
+            try:
+                for name in scenarios:
+                    scenario_client, method, url, body = requests[name]
+                    results[name] = await run_load(
+                        scenario_client,
+                        method,
+                        url,
+                        json_headers,
+                        body,
+                        options.concurrency,
+                        options.duration,
+                        options.warmup,
+                    )
+            finally:
+                if direct is not client:
+                    await direct.aclose()
+
+    report = {
+        "benchmark": "proxy",
+        "parameters": {
+            "concurrency": options.concurrency,
+            "duration": options.duration,
+            "latency_ms": options.latency_ms,
+            "payload_bytes": options.payload_bytes,
+            "post_bytes": options.post_bytes,
+            "transport": "unix" if options.unix_sockets else "tcp",
+        },
+        "scenarios": results,
+    }
+    if "direct-get" in results and "proxy-get" in results:
+        report["proxy_vs_direct"] = compare_to_direct(
+            results["direct-get"], results["proxy-get"]
+        )
+    return report
+
+
+def compare_to_direct(direct: dict, proxied: dict) -> dict:
+    """What going through the gateway costs: added latency, relative throughput."""
+    return {
+        "added_p50_ms": proxied["p50_ms"] - direct["p50_ms"],
+        "added_p95_ms": proxied["p95_ms"] - direct["p95_ms"],
+        "rps_ratio": proxied["rps"] / direct["rps"] if direct["rps"] else None,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{'scenario':<12} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8}   {'overhead p50/p95/p99 (ms)'}"
+    )
+    for name, result in report["scenarios"].items():
+        overhead = result.get("overhead")
+        overhead_text = (
+            "/".join(format_ms(overhead[k]) for k in ("p50_ms", "p95_ms", "p99_ms"))
+            if overhead
+            else "-"
+        )
+        print(
+            f"{name:<12} {result['requests']:>9} {result['errors']:>7} "
+            f"{result['rps']:>9.1f} {format_ms(result['p50_ms']):>8} "
+            f"{format_ms(result['p95_ms']):>8} {format_ms(result['p99_ms']):>8}   "
+            f"{overhead_text}"
+        )
+    versus = report.get("proxy_vs_direct")
+    if versus:
+        ratio = versus["rps_ratio"]
+        print(
+            f"proxy-get vs direct-get: +{format_ms(versus['added_p50_ms'])} ms p50, "
+            f"+{format_ms(versus['added_p95_ms'])} ms p95, "
+            f"{'-' if ratio is None else f'{ratio:.2f}'}x req/s"
+        )
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = any(r["errors"] for r in report["scenarios"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
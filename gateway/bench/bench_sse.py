@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+SSE fan-out and delivery-latency benchmark.
+
+Starts a gateway and one mock OpenCode instance that publishes timestamped
+bench.tick events at a fixed rate, then opens N concurrent subscriptions to
+/projects/{name}/api/event through the gateway. Some subscribers can read
+slowly (they sleep between reads), which is what a phone on a bad network
+looks like to the gateway.
+
+Reports, separately for normal and slow subscribers: events delivered,
+delivery throughput, end-to-end latency (mock publish -> subscriber read)
+p50/p95/p99/max and events missed; and the gateway's CPU and RSS.
+
+Usage:
+    python bench_sse.py --subscribers 100 --event-rate 50 --duration 20
+    python bench_sse.py --subscribers 50 --slow-subscribers 5 --slow-read-ms 200
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+from harness import Gateway, format_ms, process_stats, summarize_ms
+
+# bench.tick properties as serialized by mock_opencode.py
+TICK = re.compile(rb'"seq": (\d+), "ts": ([0-9.]+)')
+
+RESOURCE_SAMPLE_INTERVAL = 0.5
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument(
+        "--slow-subscribers",
+        type=int,
+        default=0,
+        help="How many of the subscribers read slowly",
+    )
+    parser.add_argument(
+        "--slow-read-ms",
+        type=float,
+        default=100.0,
+        help="Pause of a slow subscriber after every read",
+    )
+    parser.add_argument(
+        "--event-rate", type=float, default=20.0, help="Events per second upstream"
+    )
+    parser.add_argument(
+        "--event-bytes", type=int, default=256, help="Padding per event"
+    )
+    parser.add_argument("--duration", type=float, default=15.0, help="Measured seconds")
+    parser.add_argument(
+        "--warmup", type=float, default=2.0, help="Unmeasured seconds after connect"
+    )
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    return parser.parse_args(argv)
+
+
+class Subscriber:
+    """One SSE subscription and what it received."""
+
+    def __init__(self, slow_read: float = 0.0):
+        self.slow_read = slow_read
+        self.latencies_ms: list[float] = []
+        self.received = 0
+        self.missed = 0
+        self.last_seq: int | None = None
+        self.connected = asyncio.Event()
+        self.error: str | None = None
+
+    async def run(
+        self, client: httpx.AsyncClient, url: str, headers: dict, measure_from: list
+    ) -> None:
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                self.connected.set()
+                buffer = b""
+                async for chunk in response.aiter_raw():
+                    now = time.time()
+                    buffer += chunk
+                    *events, buffer = buffer.split(b"\n\n")
+                    for event in events:
+                        self.record(event, now, measure_from[0])
+                    if self.slow_read:
+                        await asyncio.sleep(self.slow_read)
+        except httpx.HTTPError as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.connected.set()
+
+    def record(self, event: bytes, now: float, measure_from: float) -> None:
+        match = TICK.search(event)
+        if not match:
+            return
+        seq, published = int(match.group(1)), float(match.group(2))
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            gap = seq - self.last_seq - 1
+        else:
+            gap = 0
+        self.last_seq = seq
+        if now < measure_from:
+            return
+        self.missed += gap
+        self.received += 1
+        self.latencies_ms.append((now - published) * 1000)
+
+
+def summarize_group(
+    subscribers: list[Subscriber], duration: float, latest_seq: int
+) -> dict:
+    latencies = [ms for s in subscribers for ms in s.latencies_ms]
+    received = sum(s.received for s in subscribers)
+    return {
+        "subscribers": len(subscribers),
+        "errors": sum(1 for s in subscribers if s.error),
+        "events": received,
+        "events_per_second": received / duration,
+        "missed": sum(s.missed for s in subscribers),
+        # Events published but not yet read by the furthest-behind subscriber
+        "behind": max(latest_seq - (s.last_seq or 0) for s in subscribers),
+        **summarize_ms(latencies),
+    }
+
+
+async def sample_gateway(pid: int, samples: list) -> None:
+    while True:
+        samples.append((time.monotonic(), process_stats(pid)))
+        await asyncio.sleep(RESOURCE_SAMPLE_INTERVAL)
+
+
+async def run(options: argparse.Namespace) -> dict:
+    opencode_args = (
+        f"--event-rate {options.event_rate} --event-bytes {options.event_bytes}"
+    )
+    slow_read = options.slow_read_ms / 1000
+    subscribers = [
+        Subscriber(slow_read if i < options.slow_subscribers else 0.0)
+        for i in range(options.subscribers)
+    ]
+    # Ticks received before this wall-clock time are not measured
+    measure_from = [float("inf")]
+
+    async with Gateway(projects=1, opencode_args=opencode_args) as gateway:
+        project = gateway.projects[0]
+        await gateway.start_project(project)
+        url = f"{gateway.url}/projects/{project}/api/event"
+        limits = httpx.Limits(max_connections=options.subscribers + 1)
+        timeout = httpx.Timeout(30.0, read=None)
+
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            tasks = [
+                asyncio.create_task(s.run(client, url, gateway.headers, measure_from))
+                for s in subscribers
+            ]
+            await asyncio.wait_for(
+                asyncio.gather(*(s.connected.wait() for s in subscribers)), 60
+            )
+            await asyncio.sleep(options.warmup)
+
+            samples: list = []
+            sampler = asyncio.create_task(sample_gateway(gateway.process.pid, samples))
+            measure_from[0] = time.time()
+            await asyncio.sleep(options.duration)
+            sampler.cancel()
+            samples.append((time.monotonic(), process_stats(gateway.process.pid)))
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    (start, first), (end, last) = samples[0], samples[-1]
+    normal = [s for s in subscribers if not s.slow_read]
+    slow = [s for s in subscribers if s.slow_read]
+    latest_seq = max(s.last_seq or 0 for s in subscribers)
+    groups = {"normal": summarize_group(normal, options.duration, latest_seq)}
+    if slow:
+        groups["slow"] = summarize_group(slow, options.duration, latest_seq)
+
+    return {
+        "benchmark": "sse",
+        "parameters": {
+            "subscribers": options.subscribers,
+            "slow_subscribers": options.slow_subscribers,
+            "slow_read_ms": options.slow_read_ms,
+            "event_rate": options.event_rate,
+            "event_bytes": options.event_bytes,
+            "duration": options.duration,
+        },
+        "groups": groups,
+        "gateway": {
+            "cpu_percent": (last["cpu_seconds"] - first["cpu_seconds"])
+            / (end - start)
+            * 100,
+            "rss_start_bytes": first["rss_bytes"],
+            "rss_max_bytes": max(stats["rss_bytes"] for _, stats in samples),
+            "rss_end_bytes": last["rss_bytes"],
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    params = report["parameters"]
+    print(
+        f"{params['subscribers']} subscribers ({params['slow_subscribers']} slow), "
+        f"{params['event_rate']:g} events/s of {params['event_bytes']} bytes, "
+        f"{params['duration']:g}s"
+    )
+    print(
+        f"{'group':<8} {'subs':>5} {'errors':>7} {'events':>9} {'ev/s':>9} "
+        f"{'missed':>7} {'behind':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>9}"
+    )
+    for name, group in report["groups"].items():
+        print(
+            f"{name:<8} {group['subscribers']:>5} {group['errors']:>7} "
+            f"{group['events']:>9} {group['events_per_second']:>9.1f} "
+            f"{group['missed']:>7} {group['behind']:>7} {format_ms(group['p50_ms']):>8} "
+            f"{format_ms(group['p95_ms']):>8} {format_ms(group['p99_ms']):>8} "
+            f"{format_ms(group['max_ms']):>9}"
+        )
+    gateway = report["gateway"]
+    mib = 1024 * 1024
+    print(
+        f"gateway: {gateway['cpu_percent']:.1f}% CPU, RSS "
+        f"{gateway['rss_start_bytes'] / mib:.1f} -> "
+        f"{gateway['rss_end_bytes'] / mib:.1f} MiB "
+        f"(max {gateway['rss_max_bytes'] / mib:.1f} MiB)"
+    )
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    report = asyncio.run(run(options))
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = any(group["errors"] for group in report["groups"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
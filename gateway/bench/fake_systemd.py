@@ -0,0 +1,124 @@
+"""
+Fake systemctl/journalctl for gateway benchmarks.
+
+The executables in bench/shim/ call into this module, so putting that
+directory first on the gateway's PATH lets start, stop and status run
+without a systemd user manager. "Units" are mock_opencode.py processes; their
+pids and output live in FAKE_SYSTEMD_STATE.
+
+Environment:
+    FAKE_SYSTEMD_STATE   Directory for pids, logs and calls.log (required)
+    FAKE_SYSTEMD_PYTHON  Interpreter used to run the mock (default: python3)
+    FAKE_OPENCODE_ARGS   Extra arguments for mock_opencode.py
+    FAKE_OPENCODE_SOCKET_DIR  Run units on <dir>/<instance>.sock instead of a port
+"""
+
+import os
+import shlex
+import signal
+import subprocess
+from pathlib import Path
+
+MOCK_OPENCODE = Path(__file__).with_name("mock_opencode.py")
+
+
+def state_dir() -> Path:
+    path = Path(os.environ["FAKE_SYSTEMD_STATE"])
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def unit_name(unit: str) -> str:
+    return unit.removesuffix(".service")
+
+
+def unit_pid(unit: str) -> int | None:
+    """Pid of a running unit, or None."""
+    pid_file = state_dir() / f"{unit}.pid"
+    try:
+        pid = int(pid_file.read_text())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def start_unit(unit: str) -> int:
+    if unit_pid(unit):
+        return 0
+    log = open(state_dir() / f"{unit}.log", "a")
+    socket_dir = os.environ.get("FAKE_OPENCODE_SOCKET_DIR")
+    if socket_dir:
+        # Like %t/opencode/%i.sock in a unit template
+        Path(socket_dir).mkdir(parents=True, exist_ok=True)
+        instance = unit.partition("@")[2]
+        listen = ["--unix-socket", os.path.join(socket_dir, f"{instance}.sock")]
+    else:
+        listen = ["--port", "0"]
+    command = [
+        os.environ.get("FAKE_SYSTEMD_PYTHON", "python3"),
+        str(MOCK_OPENCODE),
+        *listen,
+        *shlex.split(os.environ.get("FAKE_OPENCODE_ARGS", "")),
+    ]
+    proc = subprocess.Popen(
+        command,
+        stdout=log,
+        stderr=log,
+        stdin=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    (state_dir() / f"{unit}.pid").write_text(str(proc.pid))
+    return 0
+
+
+def stop_unit(unit: str) -> int:
+    pid = unit_pid(unit)
+    if pid:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    (state_dir() / f"{unit}.pid").unlink(missing_ok=True)
+    return 0
+
+
+def systemctl(argv: list[str]) -> int:
+    with open(state_dir() / "calls.log", "a") as f:
+        f.write(" ".join(["systemctl", *argv]) + "\n")
+
+    args = [a for a in argv if not a.startswith("--")]
+    if not args:
+        return 0
+    action = args[0]
+    unit = unit_name(args[1]) if len(args) > 1 else ""
+
+    if action == "is-active":
+        running = unit_pid(unit) is not None
+        print("active" if running else "inactive")
+        return 0 if running else 3
+    if action in ("start", "restart"):
+        if action == "restart":
+            stop_unit(unit)
+        return start_unit(unit)
+    if action == "stop":
+        return stop_unit(unit)
+    if action == "list-units":
+        # Running units only, in --no-legend --plain format
+        for pid_file in sorted(state_dir().glob("*.pid")):
+            if unit_pid(pid_file.stem):
+                print(f"{pid_file.stem}.service loaded active running {pid_file.stem}")
+        return 0
+    # set-property, revert, daemon-reload, ...: accepted and ignored
+    return 0
+
+
+def journalctl(argv: list[str]) -> int:
+    if "-u" not in argv:
+        return 0
+    unit = unit_name(argv[argv.index("-u") + 1])
+    lines = int(argv[argv.index("-n") + 1]) if "-n" in argv else 50
+    log = state_dir() / f"{unit}.log"
+    if log.exists():
+        print("\n".join(log.read_text().splitlines()[-lines:]))
+    return 0
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Performance regression gate.
+
+Runs the gateway benchmark scenarios with fixed parameters, writes their
+results as JSON and compares the key metrics to a stored baseline. Exits
+non-zero when a metric is worse than the baseline by more than its
+tolerance, so it can gate a change in CI or before a merge.
+
+    proxy        bench_proxy.py   proxied GET/POST throughput and latency
+    cold_start   bench_cold_start.py  start + first request via the fake service manager
+    sse          bench_sse.py     SSE fan-out delivery latency, CPU and memory
+    projects     bench_projects.py    /projects listing with many directories
+
+Usage:
+    python gate.py                          # run all, compare to baseline.json
+    python gate.py --scenario proxy --output results.json
+    python gate.py --compare results.json   # compare earlier results only
+    python gate.py --update-baseline        # run all and store as the baseline
+
+Baselines are only comparable on the machine that recorded them; regenerate
+with --update-baseline when the benchmark host changes.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import bench_cold_start
+import bench_projects
+import bench_proxy
+import bench_sse
+from harness import BENCH_DIR
+
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+DEFAULT_TOLERANCE = 0.25
+
+# Scenario -> (benchmark module, arguments)
+SCENARIOS = {
+    "proxy": (
+        bench_proxy,
+        ["--concurrency", "8", "--duration", "5", "--warmup", "1"],
+    ),
+    "cold_start": (bench_cold_start, ["--iterations", "5"]),
+    "sse": (
+        bench_sse,
+        ["--subscribers", "20", "--event-rate", "20", "--duration", "5"],
+    ),
+    "projects": (
+        bench_projects,
+        ["--projects", "50", "--running", "2", "--requests", "10"],
+    ),
+}
+
+# Gated metrics: (name, scenario, path in the report, better, absolute slack).
+# Differences within the slack never count, so near-zero timings do not
+# flap on noise.
+METRICS = [
+    ("proxy.get.rps", "proxy", "scenarios.proxy-get.rps", "higher", 0),
+    ("proxy.get.p95_ms", "proxy", "scenarios.proxy-get.p95_ms", "lower", 2),
+    # Proxy GET against the mock directly: Server-Timing misses the time
+    # spent outside the application (parsing, event loop queueing)
+    ("proxy.get.added_p50_ms", "proxy", "proxy_vs_direct.added_p50_ms", "lower", 2),
+    ("proxy.get.rps_ratio", "proxy", "proxy_vs_direct.rps_ratio", "higher", 0.05),
+    ("proxy.post.rps", "proxy", "scenarios.proxy-post.rps", "higher", 0),
+    ("proxy.post.p95_ms", "proxy", "scenarios.proxy-post.p95_ms", "lower", 2),
+    ("cold_start.start.p50_ms", "cold_start", "scenarios.start.p50_ms", "lower", 50),
+    (
+        "cold_start.first_request.p50_ms",
+        "cold_start",
+        "scenarios.first_request.p50_ms",
+        "lower",
+        5,
+    ),
+    ("sse.delivery.p95_ms", "sse", "groups.normal.p95_ms", "lower", 2),
+    (
+        "sse.events_per_second",
+        "sse",
+        "groups.normal.events_per_second",
+        "higher",
+        0,
+    ),
+    ("sse.gateway_cpu_percent", "sse", "gateway.cpu_percent", "lower", 2),
+    ("sse.gateway_rss_max_bytes", "sse", "gateway.rss_max_bytes", "lower", 4 << 20),
+    ("projects.list.p50_ms", "projects", "scenarios.list.p50_ms", "lower", 5),
+    ("projects.status.p50_ms", "projects", "scenarios.status.p50_ms", "lower", 5),
+]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Run only these scenarios (repeatable)",
+    )
+    parser.add_argument("--output", metavar="PATH", help="Write results as JSON")
+    parser.add_argument(
+        "--baseline", metavar="PATH", type=Path, default=DEFAULT_BASELINE
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="RESULTS",
+        type=Path,
+        help="Compare an earlier results file instead of running",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help=f"Relative tolerance for metrics without their own "
+        f"(default: baseline's, else {DEFAULT_TOLERANCE})",
+    )
+    return parser.parse_args(argv)
+
+
+def lookup(report: dict, path: str):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def report_errors(report: dict) -> int:
+    """Failed requests or subscriptions recorded anywhere in a report."""
+    groups = {**report.get("scenarios", {}), **report.get("groups", {})}
+    return sum(group.get("errors", 0) for group in groups.values())
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scenarios(names: list[str]) -> dict:
+    reports = {}
+    for name in names:
+        module, args = SCENARIOS[name]
+        print(f"== {name}", flush=True)
+        reports[name] = asyncio.run(module.run(module.parse_args(args)))
+        module.print_report(reports[name])
+
+    metrics = {}
+    for metric, scenario, path, _, _ in METRICS:
+        if scenario in reports:
+            metrics[metric] = lookup(reports[scenario], path)
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "errors": {name: report_errors(report) for name, report in reports.items()},
+        "metrics": metrics,
+        "reports": reports,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float | None) -> bool:
+    """Print a comparison table; True when nothing regressed."""
+    default_tolerance = tolerance or baseline.get("tolerance", DEFAULT_TOLERANCE)
+    ok = True
+
+    for scenario, errors in results.get("errors", {}).items():
+        if errors:
+            print(f"{scenario}: {errors} failed requests")
+            ok = False
+
+    print(f"{'metric':<34} {'baseline':>12} {'current':>12} {'change':>8}  result")
+    for metric, _, _, better, slack in METRICS:
+        current = results["metrics"].get(metric)
+        expected = baseline.get("metrics", {}).get(metric)
+        if current is None or expected is None:
+            if current is not None:
+                print(f"{metric:<34} {'-':>12} {current:>12.2f} {'':>8}  no baseline")
+            continue
+
+        base = expected["value"]
+        allowed = expected.get("tolerance", default_tolerance)
+        delta = current - base
+        worse = delta > 0 if better == "lower" else delta < 0
+        regressed = worse and abs(delta) > max(abs(base) * allowed, slack)
+        change = f"{delta / base * 100:+.1f}%" if base else "-"
+        verdict = "REGRESSION" if regressed else "ok"
+        ok &= not regressed
+        print(f"{metric:<34} {base:>12.2f} {current:>12.2f} {change:>8}  {verdict}")
+
+    return ok
+
+
+def baseline_from(results: dict, tolerance: float | None) -> dict:
+    betters = {metric: better for metric, _, _, better, _ in METRICS}
+    return {
+        "revision": results["revision"],
+        "host": results["host"],
+        "python": results["python"],
+        "tolerance": tolerance or DEFAULT_TOLERANCE,
+        "metrics": {
+            metric: {"value": round(value, 3), "better": betters[metric]}
+            for metric, value in results["metrics"].items()
+            if value is not None
+        },
+    }
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+
+    if options.compare:
+        results = json.loads(options.compare.read_text())
+    else:
+        results = run_scenarios(options.scenario or list(SCENARIOS))
+        if options.output:
+            Path(options.output).write_text(json.dumps(results, indent=2))
+
+    if options.update_baseline:
+        baseline = baseline_from(results, options.tolerance)
+        if options.baseline.exists() and options.scenario:
+            # Keep metrics of scenarios that were not re-run
+            previous = json.loads(options.baseline.read_text())
+            baseline["metrics"] = {**previous["metrics"], **baseline["metrics"]}
+        options.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"Baseline written to {options.baseline}")
+        return 0
+
+    if not options.baseline.exists():
+        print(f"No baseline at {options.baseline}; run with --update-baseline")
+        return 2
+
+    baseline = json.loads(options.baseline.read_text())
+    return 0 if compare(results, baseline, options.tolerance) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+Shared pieces of the gateway benchmarks.
+
+`Gateway` runs main.py under uvicorn with a temporary HOME_DIR and STATE_DIR
+and with bench/shim/ first on PATH, so instances are mock_opencode.py
+processes managed by the fake service manager. The rest are small helpers
+for latency statistics and Server-Timing parsing.
+"""
+
+import asyncio
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+GATEWAY_DIR = BENCH_DIR.parent
+SHIM_DIR = BENCH_DIR / "shim"
+AUTH_SECRET = "bench-secret"
+
+# Phases of the gateway's Server-Timing header spent talking to OpenCode
+UPSTREAM_PHASES = ("connect", "upstream", "transfer")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank percentile of a sequence (None if empty)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize_ms(values_ms) -> dict:
+    """p50/p95/p99/max of a list of milliseconds."""
+    values_ms = list(values_ms)
+    return {
+        "p50_ms": percentile(values_ms, 0.5),
+        "p95_ms": percentile(values_ms, 0.95),
+        "p99_ms": percentile(values_ms, 0.99),
+        "max_ms": max(values_ms, default=None),
+    }
+
+
+def parse_server_timing(header: str) -> dict[str, float]:
+    """Parse "phase;dur=1.2, total;dur=3.4" into {phase: milliseconds}."""
+    timings = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def gateway_overhead_ms(header: str) -> Optional[float]:
+    """Time the gateway spent on a request outside of OpenCode, from Server-Timing."""
+    timings = parse_server_timing(header)
+    if "total" not in timings:
+        return None
+    return timings["total"] - sum(timings.get(p, 0.0) for p in UPSTREAM_PHASES)
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def process_stats(pid: int) -> dict:
+    """CPU seconds, RSS, open fds, sockets and threads of a process (Linux /proc)."""
+    proc = Path(f"/proc/{pid}")
+    # Fields after the parenthesised command name; utime/stime are 14/15
+    fields = (proc / "stat").read_text().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    fds = []
+    for fd in os.listdir(proc / "fd"):
+        try:
+            fds.append(os.readlink(proc / "fd" / fd))
+        except OSError:
+            pass  # Closed while listing
+    stats = {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "threads": int(fields[17]),
+        "fds": len(fds),
+        "sockets": sum(1 for target in fds if target.startswith("socket:")),
+    }
+    for line in (proc / "status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            stats["rss_bytes"] = int(line.split()[1]) * 1024
+    return stats
+
+
+class Gateway:
+    """A gateway process wired to the fake service manager.
+
+    Usage:
+        async with Gateway(projects=3, opencode_args="--latency-ms 5") as gw:
+            port = await gw.start_project(gw.projects[0])
+    """
+
+    def __init__(
+        self,
+        projects: int = 1,
+        opencode_args: str = "",
+        env: Optional[dict] = None,
+        workdir: Optional[Path] = None,
+        unix_sockets: bool = False,
+    ):
+        self.project_count = projects
+        self.opencode_args = opencode_args
+        self.unix_sockets = unix_sockets
+        self.extra_env = env or {}
+        self.workdir = workdir
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.headers = {"Authorization": f"Bearer {AUTH_SECRET}"}
+        self.projects = [f"bench-{i:04d}" for i in range(projects)]
+        self.process: Optional[subprocess.Popen] = None
+        self.env: dict = {}
+        self._own_workdir = workdir is None
+
+    @property
+    def home_dir(self) -> Path:
+        return self.workdir / "home"
+
+    @property
+    def systemd_state(self) -> Path:
+        return self.workdir / "systemd"
+
+    @property
+    def log_path(self) -> Path:
+        return self.workdir / "gateway.log"
+
+    def create_projects(self) -> None:
+        for i, name in enumerate(self.projects):
+            project = self.home_dir / name
+            project.mkdir(parents=True, exist_ok=True)
+            # Mix of project kinds, like a real home directory
+            if i % 2 == 0:
+                (project / ".git").mkdir(exist_ok=True)
+            if i % 3 == 0:
+                (project / "package.json").write_text("{}")
+
+    def start(self) -> None:
+        if self.workdir is None:
+            self.workdir = Path(tempfile.mkdtemp(prefix="viberemote-bench-"))
+        self.create_projects()
+        self.systemd_state.mkdir(parents=True, exist_ok=True)
+
+        self.env = env = {
+            **os.environ,
+            "PATH": f"{SHIM_DIR}{os.pathsep}{os.environ.get('PATH', '')}",
+            "PYTHONUNBUFFERED": "1",
+            "VIBE_AUTH_SECRET": AUTH_SECRET,
+            "HOME_DIR": str(self.home_dir),
+            "STATE_DIR": str(self.workdir / "state"),
+            "CGROUP_ROOT": str(self.workdir / "cgroup"),
+            "WARMUP_TOP_N": "0",
+            "FAKE_SYSTEMD_STATE": str(self.systemd_state),
+            "FAKE_SYSTEMD_PYTHON": sys.executable,
+            "FAKE_OPENCODE_ARGS": self.opencode_args,
+            **self.extra_env,
+        }
+        if self.unix_sockets:
+            socket_dir = str(self.workdir / "run")
+            env["INSTANCE_SOCKET_DIR"] = env["FAKE_OPENCODE_SOCKET_DIR"] = socket_dir
+        log = open(self.log_path, "ab")
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--no-access-log",
+            ],
+            cwd=GATEWAY_DIR,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+        )
+
+    async def wait_ready(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(timeout=1.0) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(
+                        f"Gateway exited with {self.process.returncode}, "
+                        f"see {self.log_path}"
+                    )
+                try:
+                    if (await client.get(f"{self.url}/ready")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise RuntimeError(f"Gateway not ready after {timeout}s, see {self.log_path}")
+
+    def stop_instances(self) -> None:
+        """Terminate every mock instance started through the fake systemctl."""
+        for pid_file in self.systemd_state.glob("*.pid"):
+            try:
+                os.kill(int(pid_file.read_text()), signal.SIGTERM)
+            except (OSError, ValueError):
+                pass
+            pid_file.unlink(missing_ok=True)
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.workdir:
+            self.stop_instances()
+            if self._own_workdir:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def systemctl(self, *args: str) -> int:
+        """Run the fake systemctl as the gateway would (e.g. to restart behind its back)."""
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(SHIM_DIR / "systemctl"),
+            "--user",
+            *args,
+            env=self.env,
+            stdout=subprocess.DEVNULL,
+        )
+        return await proc.wait()
+
+    async def metric(self, name: str, client=None) -> Optional[float]:
+        """Current value of an unlabelled metric from /metrics."""
+        own_client = client is None
+        client = client or httpx.AsyncClient(timeout=10.0)
+        try:
+            response = await client.get(f"{self.url}/metrics", headers=self.headers)
+            for line in response.text.splitlines():
+                metric, _, value = line.partition(" ")
+                if metric == name:
+                    return float(value)
+            return None
+        finally:
+            if own_client:
+                await client.aclose()
+
+    async def start_project(self, name: str, client=None) -> int | str:
+        """Start a project through the gateway and return its port or socket."""
+        own_client = client is None
+        client = client or httpx.AsyncClient(timeout=60.0)
+        try:
+            response = await client.post(
+                f"{self.url}/projects/{name}/start", headers=self.headers
+            )
+            response.raise_for_status()
+            started = response.json()
+            return started["port"] or started["socket"]
+        finally:
+            if own_client:
+                await client.aclose()
+
+    async def __aenter__(self) -> "Gateway":
+        self.start()
+        try:
+            await self.wait_ready()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Mock OpenCode server for gateway benchmarks.
+
+Implements the parts of the OpenCode API the gateway and the app use
+(health, sessions, session status, prompt_async, abort, /event) and answers
+every other path with a JSON payload of configurable size. Prints the same
+"listening on" line as `opencode serve`, so the gateway finds its port in the
+(fake) journal. With --unix-socket it listens on that socket instead.
+
+Usage:
+    python mock_opencode.py --port 0 --latency-ms 5 --payload-bytes 4096
+    python mock_opencode.py --event-rate 200 --event-bytes 512
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument(
+        "--unix-socket", metavar="PATH", help="Listen on a Unix socket instead"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="Delay before each response"
+    )
+    parser.add_argument(
+        "--payload-bytes", type=int, default=256, help="Size of generic responses"
+    )
+    parser.add_argument(
+        "--event-rate",
+        type=float,
+        default=0.0,
+        help="bench.tick events per second on /event (0 disables)",
+    )
+    parser.add_argument(
+        "--event-bytes", type=int, default=0, help="Padding added to bench.tick events"
+    )
+    parser.add_argument(
+        "--tokens", type=int, default=20, help="Text deltas per generated reply"
+    )
+    parser.add_argument(
+        "--token-interval-ms",
+        type=float,
+        default=20.0,
+        help="Delay between text deltas",
+    )
+    parser.add_argument(
+        "--startup-delay",
+        type=float,
+        default=0.0,
+        help="Seconds before the server listens (simulates a slow cold start)",
+    )
+    return parser.parse_args(argv)
+
+
+args = parse_args()
+app = FastAPI()
+
+# One queue per /event subscriber
+subscribers: set[asyncio.Queue] = set()
+sessions: dict[str, dict] = {}
+session_status: dict[str, str] = {}
+background_tasks: set[asyncio.Task] = set()
+
+
+def publish(event_type: str, properties: dict) -> None:
+    """Send an event to every /event subscriber."""
+    event = {"type": event_type, "properties": properties}
+    for queue in list(subscribers):
+        queue.put_nowait(event)
+
+
+async def simulate_latency() -> None:
+    if args.latency_ms:
+        await asyncio.sleep(args.latency_ms / 1000)
+
+
+def spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+@app.get("/global/health")
+async def health():
+    return {"healthy": True}
+
+
+@app.get("/session")
+async def list_sessions():
+    await simulate_latency()
+    return list(sessions.values())
+
+
+@app.post("/session")
+async def create_session(request: Request):
+    await request.body()
+    await simulate_latency()
+    session_id = f"ses_{uuid.uuid4().hex[:12]}"
+    sessions[session_id] = {"id": session_id, "title": "Benchmark session"}
+    return sessions[session_id]
+
+
+@app.get("/session/status")
+async def get_session_status():
+    return {sid: {"type": status} for sid, status in session_status.items()}
+
+
+async def generate_reply(session_id: str, model: dict) -> None:
+    """Emit the event sequence of one assistant reply."""
+    session_status[session_id] = "busy"
+    publish("session.status", {"sessionID": session_id, "status": {"type": "busy"}})
+
+    message_id = f"msg_{uuid.uuid4().hex[:12]}"
+    info = {
+        "id": message_id,
+        "sessionID": session_id,
+        "role": "assistant",
+        "time": {"created": int(time.time() * 1000)},
+        "providerID": model.get("providerID", "mock"),
+        "modelID": model.get("modelID", "mock-model"),
+    }
+    publish("message.updated", {"info": info})
+
+    text = ""
+    for i in range(args.tokens):
+        await asyncio.sleep(args.token_interval_ms / 1000)
+        delta = f"tok{i} "
+        text += delta
+        part = {
+            "id": f"prt_{message_id}",
+            "sessionID": session_id,
+            "messageID": message_id,
+            "type": "text",
+            "text": text,
+        }
+        publish("message.part.updated", {"part": part, "delta": delta})
+
+    info["time"]["completed"] = int(time.time() * 1000)
+    info["tokens"] = {"input": 10, "output": args.tokens, "reasoning": 0}
+    publish("message.updated", {"info": info})
+    session_status[session_id] = "idle"
+    publish("session.status", {"sessionID": session_id, "status": {"type": "idle"}})
+    publish("session.idle", {"sessionID": session_id})
+
+
+@app.post("/session/{session_id}/prompt_async")
+async def prompt_async(session_id: str, request: Request):
+    body = await request.json()
+    await simulate_latency()
+    spawn(generate_reply(session_id, body.get("model") or {}))
+    return Response(status_code=204)
+
+
+@app.post("/session/{session_id}/abort")
+async def abort(session_id: str):
+    return True
+
+
+@app.get("/event")
+async def events():
+    queue: asyncio.Queue = asyncio.Queue()
+    subscribers.add(queue)
+
+    async def stream():
+        try:
+            yield b'data: {"type":"server.connected","properties":{}}\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=10)
+                except asyncio.TimeoutError:
+                    event = {"type": "server.heartbeat", "properties": {}}
+                yield f"data: {json.dumps(event)}\n\n".encode()
+        finally:
+            subscribers.discard(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def catch_all(path: str, request: Request):
+    await request.body()
+    await simulate_latency()
+    return JSONResponse({"path": path, "data": "x" * args.payload_bytes})
+
+
+async def tick_events() -> None:
+    """Publish timestamped events at a fixed rate (for delivery latency)."""
+    interval = 1 / args.event_rate
+    padding = "x" * args.event_bytes
+    seq = 0
+    next_at = time.monotonic()
+    while True:
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        seq += 1
+        publish("bench.tick", {"seq": seq, "ts": time.time(), "padding": padding})
+
+
+async def main() -> None:
+    if args.startup_delay:
+        await asyncio.sleep(args.startup_delay)
+
+    if args.unix_socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)  # Left behind by a killed instance
+        sock.bind(args.unix_socket)
+        listening_on = f"unix:{args.unix_socket}"
+    else:
+        # IPPROTO_TCP explicitly: asyncio only sets TCP_NODELAY on accepted
+        # connections of TCP-protocol sockets, and without it responses on
+        # kept-alive connections stall on delayed ACKs
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((args.host, args.port))
+        listening_on = f"http://{args.host}:{sock.getsockname()[1]}"
+    sock.listen(1024)
+
+    if args.event_rate:
+        spawn(tick_events())
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    print(f"opencode server listening on {listening_on}", flush=True)
+    await server.serve(sockets=[sock])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Soak test for memory, file-descriptor and task leaks.
+
+Runs a gateway against mock OpenCode instances for a long time while
+churning everything that allocates per-connection state:
+
+    requests   short-lived clients sending a few proxied GET/POST requests
+    streams    /event subscriptions dropped after a random time
+    restarts   stop + start through the gateway, and restarts behind the
+               gateway's back (the instance comes back on a new port)
+
+Every --sample-interval it records the gateway's RSS, open fds, sockets,
+threads and asyncio task count. At the end it compares the median of the
+last third of the samples to the first third (after --settle seconds) and
+fails when any of them grew by more than its allowance.
+
+Usage:
+    python soak.py --duration 14400 --csv soak.csv
+    python soak.py --duration 300 --projects 2 --restart-interval 5
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+from harness import Gateway, process_stats
+
+MIB = 1024 * 1024
+
+# Metric name -> CLI option holding its allowed growth
+TRACKED = {
+    "rss_mib": "max_rss_growth_mib",
+    "fds": "max_fd_growth",
+    "sockets": "max_socket_growth",
+    "threads": "max_thread_growth",
+    "tasks": "max_task_growth",
+}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=3600.0, help="Seconds")
+    parser.add_argument("--projects", type=int, default=3)
+    parser.add_argument("--request-workers", type=int, default=4)
+    parser.add_argument("--stream-workers", type=int, default=4)
+    parser.add_argument(
+        "--restart-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between instance restarts",
+    )
+    parser.add_argument("--sample-interval", type=float, default=10.0)
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=300.0,
+        help="Seconds of samples ignored while caches and allocator arenas fill",
+    )
+    parser.add_argument("--max-rss-growth-mib", type=float, default=16.0)
+    parser.add_argument("--max-fd-growth", type=float, default=8.0)
+    parser.add_argument("--max-socket-growth", type=float, default=8.0)
+    parser.add_argument("--max-thread-growth", type=float, default=4.0)
+    parser.add_argument("--max-task-growth", type=float, default=8.0)
+    parser.add_argument("--csv", metavar="PATH", help="Write every sample as CSV")
+    parser.add_argument("--json", metavar="PATH", help="Write the summary as JSON")
+    return parser.parse_args(argv)
+
+
+class Churn:
+    """Shared state of the churn workers."""
+
+    def __init__(self, gateway: Gateway, deadline: float):
+        self.gateway = gateway
+        self.deadline = deadline
+        self.counts: dict[str, int] = {}
+
+    def running(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    def count(self, key: str) -> None:
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def api(self, project: str) -> str:
+        return f"{self.gateway.url}/projects/{project}/api"
+
+    async def requests(self) -> None:
+        """New client per batch, so every batch connects and disconnects."""
+        while self.running():
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                for _ in range(random.randint(1, 5)):
+                    project = random.choice(self.gateway.projects)
+                    try:
+                        if random.random() < 0.5:
+                            response = await client.get(
+                                f"{self.api(project)}/config",
+                                headers=self.gateway.headers,
+                            )
+                        else:
+                            response = await client.post(
+                                f"{self.api(project)}/soak/echo",
+                                headers=self.gateway.headers,
+                                json={"data": "x" * random.randint(0, 4096)},
+                            )
+                        self.count(f"request_{response.status_code}")
+                    except httpx.HTTPError as e:
+                        self.count(f"request_{type(e).__name__}")
+            await asyncio.sleep(random.uniform(0, 0.05))
+
+    async def streams(self) -> None:
+        """Subscribe to /event and drop the connection after a random time."""
+        timeout = httpx.Timeout(30.0, read=None)
+        while self.running():
+            project = random.choice(self.gateway.projects)
+            try:
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    async with client.stream(
+                        "GET",
+                        f"{self.api(project)}/event",
+                        headers=self.gateway.headers,
+                    ) as response:
+                        self.count(f"stream_{response.status_code}")
+                        async with asyncio.timeout(random.uniform(0.2, 5.0)):
+                            async for _ in response.aiter_raw():
+                                pass
+            except TimeoutError:
+                pass  # Dropped on purpose
+            except httpx.HTTPError as e:
+                self.count(f"stream_{type(e).__name__}")
+            await asyncio.sleep(random.uniform(0, 0.2))
+
+    async def restarts(self, interval: float) -> None:
+        """Alternate gateway-driven restarts and restarts behind its back."""
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            while self.running():
+                await asyncio.sleep(interval)
+                project = random.choice(self.gateway.projects)
+                if random.random() < 0.5:
+                    await client.delete(
+                        f"{self.gateway.url}/projects/{project}/stop",
+                        params={"drain": "false"},
+                        headers=self.gateway.headers,
+                    )
+                    response = await client.post(
+                        f"{self.gateway.url}/projects/{project}/start",
+                        headers=self.gateway.headers,
+                    )
+                    self.count(f"restart_{response.status_code}")
+                else:
+                    # New port; the gateway has to notice the old one is gone
+                    await self.gateway.systemctl("restart", f"opencode@{project}")
+                    self.count("restart_external")
+
+
+async def sample(gateway: Gateway, started: float) -> dict:
+    stats = process_stats(gateway.process.pid)
+    return {
+        "elapsed": round(time.monotonic() - started, 1),
+        "rss_mib": stats["rss_bytes"] / MIB,
+        "fds": stats["fds"],
+        "sockets": stats["sockets"],
+        "threads": stats["threads"],
+        "tasks": await gateway.metric("gateway_asyncio_tasks"),
+    }
+
+
+def evaluate(samples: list[dict], options: argparse.Namespace) -> dict:
+    """Growth of every tracked value between the first and last third."""
+    settled = [s for s in samples if s["elapsed"] >= options.settle]
+    third = len(settled) // 3
+    results = {}
+    for key, option in TRACKED.items():
+        allowed = getattr(options, option)
+        if third < 1:
+            results[key] = {"growth": None, "allowed": allowed, "ok": True}
+            continue
+        first = statistics.median(s[key] for s in settled[:third])
+        last = statistics.median(s[key] for s in settled[-third:])
+        growth = last - first
+        results[key] = {
+            "first": first,
+            "last": last,
+            "growth": growth,
+            "allowed": allowed,
+            "ok": growth <= allowed,
+        }
+    return results
+
+
+async def run(options: argparse.Namespace) -> dict:
+    samples: list[dict] = []
+    async with Gateway(projects=options.projects) as gateway:
+        for project in gateway.projects:
+            await gateway.start_project(project)
+
+        started = time.monotonic()
+        churn = Churn(gateway, started + options.duration)
+        workers = [
+            *(churn.requests() for _ in range(options.request_workers)),
+            *(churn.streams() for _ in range(options.stream_workers)),
+            churn.restarts(options.restart_interval),
+        ]
+        tasks = [asyncio.create_task(worker) for worker in workers]
+
+        while churn.running():
+            samples.append(await sample(gateway, started))
+            s = samples[-1]
+            print(
+                f"[{s['elapsed']:>8.0f}s] rss={s['rss_mib']:.1f}MiB fds={s['fds']} "
+                f"sockets={s['sockets']} threads={s['threads']} tasks={s['tasks']:g}",
+                flush=True,
+            )
+            await asyncio.sleep(options.sample_interval)
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Let dropped connections close before the final sample
+        await asyncio.sleep(2)
+        samples.append(await sample(gateway, started))
+
+    return {
+        "benchmark": "soak",
+        "duration": options.duration,
+        "operations": dict(sorted(churn.counts.items())),
+        "growth": evaluate(samples, options),
+        "samples": samples,
+    }
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    report = asyncio.run(run(options))
+
+    if options.csv:
+        with open(options.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(report["samples"][0]))
+            writer.writeheader()
+            writer.writerows(report["samples"])
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print("operations:", ", ".join(f"{k}={v}" for k, v in report["operations"].items()))
+    failed = False
+    for key, result in report["growth"].items():
+        if result["growth"] is None:
+            print(f"{key:<8} not enough samples after --settle")
+            continue
+        verdict = "ok" if result["ok"] else "LEAK?"
+        failed |= not result["ok"]
+        print(
+            f"{key:<8} {result['first']:>9.1f} -> {result['last']:>9.1f} "
+            f"(growth {result['growth']:+.1f}, allowed {result['allowed']:g})  {verdict}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
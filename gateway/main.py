@@ -9,26 +9,139 @@ This gateway:
 """
 
 import asyncio
+import base64
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import cProfile
+import ctypes
+import ctypes.util
+import fcntl
+import io
+import json
+import logging.handlers
+import marshal
 import os
+import pstats
 import re
+import sqlite3
+import struct
 import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
 from pathlib import Path
-from typing import Optional
+from types import SimpleNamespace
+from typing import Callable, Optional, Union
+from urllib.parse import quote
 
 import httpx
-from fastapi import FastAPI, HTTPException, Request, Response, Depends
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Request,
+    Response,
+    Depends,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 # Configuration
 AUTH_SECRET = os.environ.get("VIBE_AUTH_SECRET", "change-me-in-production")
 HOME_DIR = Path(os.environ.get("HOME_DIR", "/home/linux"))
 PORT_RANGE_START = int(os.environ.get("PORT_RANGE_START", "4096"))
 PORT_RANGE_END = int(os.environ.get("PORT_RANGE_END", "4196"))
+STATE_DIR = Path(
+    os.environ.get("STATE_DIR", str(HOME_DIR / ".local" / "state" / "viberemote"))
+)
+
+# Shared state between worker processes (uvicorn --workers N): SQLite in
+# STATE_DIR, polled for other workers' changes every interval. The instance
+# registry in the same database is kept either way.
+SHARED_STATE = os.environ.get("SHARED_STATE", "1") == "1"
+SHARED_STATE_POLL_INTERVAL = float(os.environ.get("SHARED_STATE_POLL_INTERVAL", "0.1"))
+
+# Server used by `python main.py`: "uvicorn" (HTTP/1.1) or "hypercorn"
+# (HTTP/2: h2c in cleartext, h2 over TLS when a certificate is configured)
+SERVER = os.environ.get("SERVER", "uvicorn")
+TLS_CERTFILE = os.environ.get("TLS_CERTFILE", "")
+TLS_KEYFILE = os.environ.get("TLS_KEYFILE", "")
+H2_MAX_CONCURRENT_STREAMS = int(os.environ.get("H2_MAX_CONCURRENT_STREAMS", "256"))
+
+# Unix sockets of the instances: an instance listening on <dir>/<name>.sock
+# is reached over it instead of TCP loopback (empty disables the lookup)
+INSTANCE_SOCKET_DIR = os.environ.get("INSTANCE_SOCKET_DIR", "")
+
+# Events kept per instance for GET /projects/{name}/events (long polling)
+EVENT_BUFFER_SIZE = int(os.environ.get("EVENT_BUFFER_SIZE", "1000"))
+
+# Project discovery: "auto" watches HOME_DIR with inotify and falls back to
+# polling; "poll" always polls (e.g. network filesystems)
+PROJECT_WATCH = os.environ.get("PROJECT_WATCH", "auto")
+PROJECT_POLL_INTERVAL = float(os.environ.get("PROJECT_POLL_INTERVAL", "10"))
+
+# Project metadata (git state, toolchain, size): worker threads and how often
+# everything is recollected (changes below the project root raise no events)
+METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS", "2"))
+METADATA_REFRESH_INTERVAL = float(os.environ.get("METADATA_REFRESH_INTERVAL", "600"))
+
+# Pre-warming: start the projects most likely to be opened soon. At most
+# WARMUP_TOP_N pre-warmed instances wait unused at a time, each for at most
+# WARMUP_IDLE_TIMEOUT; MAX_INSTANCES is sized for the template's MemoryMax=2G
+MAX_INSTANCES = int(os.environ.get("MAX_INSTANCES", "8"))
+WARMUP_TOP_N = int(os.environ.get("WARMUP_TOP_N", "2"))
+WARMUP_INTERVAL = float(os.environ.get("WARMUP_INTERVAL", "300"))
+WARMUP_LOOKAHEAD = float(os.environ.get("WARMUP_LOOKAHEAD", "900"))
+WARMUP_IDLE_TIMEOUT = float(os.environ.get("WARMUP_IDLE_TIMEOUT", "1800"))
+USAGE_HALF_LIFE_DAYS = float(os.environ.get("USAGE_HALF_LIFE_DAYS", "7"))
+
+# Graceful stop: how long to wait for busy sessions and open streams
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "30"))
+
+# How often ready instances are checked against systemd (crashes, restarts)
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", "30"))
+
+# Per-request phase timings: Server-Timing header and slow request log
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+
+# Structured access log: "-" for stdout, a file path, or empty to disable
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "-")
+ACCESS_LOG_MAX_BYTES = int(os.environ.get("ACCESS_LOG_MAX_BYTES", str(50 * 1024**2)))
+ACCESS_LOG_BACKUPS = int(os.environ.get("ACCESS_LOG_BACKUPS", "5"))
+ACCESS_LOG_QUEUE_SIZE = int(os.environ.get("ACCESS_LOG_QUEUE_SIZE", "10000"))
+
+# Event loop monitor: lag sampling and stack capture of blocking callbacks
+LOOP_MONITOR = os.environ.get("LOOP_MONITOR", "1") == "1"
+LOOP_SLOW_CALLBACK_MS = float(os.environ.get("LOOP_SLOW_CALLBACK_MS", "100"))
+
+# On-demand profiling: longest window a single profile may run
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+
+# Resource telemetry: cgroup v2 directory of the systemd user manager
+CGROUP_ROOT = Path(
+    os.environ.get(
+        "CGROUP_ROOT",
+        f"/sys/fs/cgroup/user.slice/user-{os.getuid()}.slice/user@{os.getuid()}.service",
+    )
+)
+TELEMETRY_INTERVAL = float(os.environ.get("TELEMETRY_INTERVAL", "10"))
+TELEMETRY_HISTORY = int(os.environ.get("TELEMETRY_HISTORY", "360"))
 
-# Track running instances: project_name -> port
-running_instances: dict[str, int] = {}
+# Serialize starts per project so warm-up and clients never race
+start_locks: dict[str, asyncio.Lock] = {}
+
+# Long-running tasks started with the app, cancelled on shutdown
+background_tasks: set[asyncio.Task] = set()
 
 app = FastAPI(
     title="VibeRemote Gateway",
@@ -36,6 +149,27 @@ app = FastAPI(
     version="1.0.0",
 )
 
+
+class ProxyFastPath:
+    """Hand /projects/{name}/api/* to proxy_request, bypassing FastAPI.
+
+    Installed innermost, so CORS and MetricsMiddleware still apply.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            match = PROXY_PATH.match(scope["path"])
+            if match:
+                await proxy_request(scope, receive, send, *match.groups())
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(ProxyFastPath)
+
 # CORS for development
 app.add_middleware(
     CORSMiddleware,
@@ -51,378 +185,4438 @@ app.add_middleware(
 # =============================================================================
 
 
-async def verify_auth(request: Request) -> None:
-    """Verify Bearer token authentication."""
-    auth_header = request.headers.get("Authorization", "")
+def auth_error(auth_header: str) -> Optional[str]:
+    """Why an Authorization header is rejected, or None if it is valid."""
     if not auth_header.startswith("Bearer "):
-        raise HTTPException(
-            status_code=401, detail="Missing or invalid Authorization header"
-        )
+        return "Missing or invalid Authorization header"
 
     token = auth_header[7:]  # Remove "Bearer " prefix
     if token != AUTH_SECRET:
-        raise HTTPException(status_code=401, detail="Invalid API key")
+        return "Invalid API key"
+    return None
+
+
+async def verify_auth(request: Request) -> None:
+    """Verify Bearer token authentication."""
+    start = time.perf_counter()
+    try:
+        error = auth_error(request.headers.get("Authorization", ""))
+        if error:
+            raise HTTPException(status_code=401, detail=error)
+    finally:
+        record_timing("auth", time.perf_counter() - start)
 
 
 # =============================================================================
-# Models
+# Metrics
 # =============================================================================
 
+# Every metric, in exposition order
+metrics_registry: list = []
 
-class Project(BaseModel):
-    name: str
-    path: str
-    has_git: bool
-    has_package_json: bool
-    is_running: bool
-    port: Optional[int] = None
+# Latency buckets in seconds, from sub-millisecond proxy hops to slow starts
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
 
 
-class StartResponse(BaseModel):
-    name: str
-    port: int
-    status: str
+def escape_label_value(value) -> str:
+    """Escape a label value for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-class StopResponse(BaseModel):
-    name: str
-    status: str
+def format_labels(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    """Render a Prometheus label set, e.g. {route="/x",project="y"}."""
+    pairs = [
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(labelnames, labels)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
 
 
-# =============================================================================
-# Helper Functions
-# =============================================================================
+class Counter:
+    """Monotonic counter keyed by a tuple of label values."""
 
+    kind = "counter"
 
-def sanitize_project_name(name: str) -> str:
-    """Sanitize project name for use in systemd service names."""
-    # Only allow alphanumeric, dash, underscore
-    return re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+        metrics_registry.append(self)
 
+    def inc(self, labels: tuple = (), amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
 
-def get_service_name(project_name: str) -> str:
-    """Get systemd service name for a project."""
-    return f"opencode@{sanitize_project_name(project_name)}"
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, format_labels(self.labelnames, labels), value
 
 
-async def run_systemctl(action: str, service: str) -> tuple[int, str, str]:
-    """Run a systemctl --user command."""
-    proc = await asyncio.create_subprocess_exec(
-        "systemctl",
-        "--user",
-        action,
-        service,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await proc.communicate()
-    return proc.returncode, stdout.decode(), stderr.decode()
+class Gauge(Counter):
+    """Point-in-time value, optionally computed at scrape time."""
 
+    kind = "gauge"
 
-async def get_service_status(project_name: str) -> tuple[bool, Optional[int]]:
-    """Check if a service is running and get its port."""
-    service = get_service_name(project_name)
-    returncode, stdout, _ = await run_systemctl("is-active", service)
+    def __init__(self, name: str, help: str, labelnames: tuple = (), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
 
-    is_running = returncode == 0
-    port = running_instances.get(project_name)
+    def set(self, labels: tuple, value: float) -> None:
+        self.values[labels] = value
 
-    # If running but we don't have the port, try to find it from logs
-    if is_running and port is None:
-        port = await find_port_from_logs(project_name)
-        if port:
-            running_instances[project_name] = port
+    def samples(self):
+        if self.collect is not None:
+            self.values = self.collect()
+        yield from super().samples()
 
-    return is_running, port
 
+class Histogram:
+    """Cumulative histogram keyed by a tuple of label values."""
 
-async def find_port_from_logs(project_name: str) -> Optional[int]:
-    """Find the port from journalctl logs."""
-    service = get_service_name(project_name)
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            "journalctl",
-            "--user",
-            "-u",
-            service,
-            "-n",
-            "50",
-            "--no-pager",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, _ = await proc.communicate()
-        output = stdout.decode()
+    kind = "histogram"
 
-        # Look for "listening on http://127.0.0.1:XXXXX"
-        # Use findall and take the LAST match to ensure we get the most recent port
-        # journalctl outputs logs chronologically (oldest first), so the last match is the newest
-        matches = re.findall(r"listening on http://[^:]+:(\d+)", output)
-        if matches:
-            return int(matches[-1])
-    except Exception:
-        pass
-    return None
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self.values: dict[tuple, list] = {}
+        metrics_registry.append(self)
 
+    def observe(self, labels: tuple, value: float) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
 
-async def wait_for_port(project_name: str, timeout: float = 30.0) -> Optional[int]:
-    """Wait for the service to start and report its port."""
-    start_time = asyncio.get_event_loop().time()
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket", le, cumulative
+            label_str = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum", label_str, total
+            yield f"{self.name}_count", label_str, cumulative
 
-    while asyncio.get_event_loop().time() - start_time < timeout:
-        port = await find_port_from_logs(project_name)
-        if port:
-            # Verify the port is actually responding
-            try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.get(
-                        f"http://127.0.0.1:{port}/global/health", timeout=2.0
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS_TOTAL = Counter(
+    "gateway_requests_total",
+    "HTTP requests handled by the gateway.",
+    ("route", "project", "method", "status"),
+)
+REQUEST_DURATION = Histogram(
+    "gateway_request_duration_seconds",
+    "Time from request to response start (SSE: time to stream open).",
+    ("route", "project"),
+)
+UPSTREAM_DURATION = Histogram(
+    "gateway_upstream_duration_seconds",
+    "Time spent waiting on the OpenCode instance for proxied requests.",
+    ("project",),
+)
+PROXY_OVERHEAD = Histogram(
+    "gateway_proxy_overhead_seconds",
+    "Gateway time of proxied requests, excluding the upstream wait.",
+    ("project",),
+)
+SUBPROCESS_DURATION = Histogram(
+    "gateway_subprocess_duration_seconds",
+    "Duration of systemctl/journalctl invocations.",
+    ("command", "action"),
+)
+PROXIED_BYTES = Counter(
+    "gateway_proxied_bytes_total",
+    "Body bytes proxied to and from OpenCode instances.",
+    ("project", "direction"),
+)
+
+
+# Phase durations (seconds) of the request being handled: phase -> seconds
+request_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+# Server-Timing order; other phases follow in the order they were recorded
+TIMING_PHASES = ("auth", "status", "connect", "upstream", "transfer")
+
+
+def record_timing(phase: str, seconds: float) -> None:
+    """Add time spent in a phase to the current request's timings."""
+    timings = request_timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def format_server_timing(timings: dict, total: float) -> bytes:
+    """Render timings as a Server-Timing header value (milliseconds)."""
+    phases = [p for p in TIMING_PHASES if p in timings]
+    phases += [p for p in timings if p not in TIMING_PHASES]
+    entries = [f"{phase};dur={timings[phase] * 1000:.1f}" for phase in phases]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries).encode()
+
+
+class MetricsMiddleware:
+    """Record request metrics and per-phase timings.
+
+    Counts and latency go to the metrics registry by route template and
+    project; phase timings are returned in a Server-Timing header and
+    requests slower than SLOW_REQUEST_MS are logged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        start = time.perf_counter()
+        status = 500
+        response_start = None
+        is_sse = False
+        request_bytes = 0
+        response_bytes = 0
+        timings: dict[str, float] = {}
+        token = request_timings.set(timings)
+
+        async def receive_wrapper():
+            nonlocal request_bytes
+            message = await receive()
+            request_bytes += len(message.get("body", b""))
+            return message
+
+        def labels() -> tuple[str, str]:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            # Unauthenticated callers must not be able to mint label values
+            project = ""
+            if status != 401:
+                project = scope.get("path_params", {}).get("project_name", "")
+            return route, project
+
+        async def send_wrapper(message):
+            nonlocal status, response_start, is_sse, response_bytes
+            if message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - start
+                response_start = elapsed
+                is_sse = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+                route, project = labels()
+                REQUEST_DURATION.observe((route, project), elapsed)
+                if "upstream" in timings:
+                    upstream = (
+                        timings.get("connect", 0.0)
+                        + timings["upstream"]
+                        + timings.get("transfer", 0.0)
                     )
-                    if resp.status_code == 200:
-                        return port
-            except Exception:
-                pass
-        await asyncio.sleep(0.5)
+                    PROXY_OVERHEAD.observe((project,), max(0.0, elapsed - upstream))
 
-    return None
+                if SERVER_TIMING:
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", ()),
+                            (b"server-timing", format_server_timing(timings, elapsed)),
+                        ],
+                    }
+                if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                    print(
+                        f"Slow request: {scope['method']} {scope['path']} -> {status} "
+                        + format_server_timing(timings, elapsed).decode()
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            route, project = labels()
+            REQUESTS_TOTAL.inc((route, project, scope["method"], str(status)))
+            if access_log_queue is not None:
+                client = scope.get("client")
+                log_access(
+                    {
+                        "ts": round(started_at, 3),
+                        "client": client[0] if client else None,
+                        "method": scope["method"],
+                        "route": route,
+                        "path": scope["path"],
+                        "project": project or None,
+                        "status": status,
+                        "request_bytes": request_bytes,
+                        "response_bytes": response_bytes,
+                        "ttfb_ms": (
+                            round(response_start * 1000, 2)
+                            if response_start is not None
+                            else None
+                        ),
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                        "sse": is_sse,
+                        "timings_ms": {
+                            phase: round(seconds * 1000, 2)
+                            for phase, seconds in timings.items()
+                        },
+                    }
+                )
+
+
+app.add_middleware(MetricsMiddleware)
 
 
 # =============================================================================
-# Endpoints
+# Access Log
 # =============================================================================
 
+# Records waiting for the writer (None when the access log is disabled)
+access_log_queue: Optional[asyncio.Queue] = None
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint (no auth required)."""
-    return {"status": "ok", "service": "viberemote-gateway"}
+ACCESS_LOG_BATCH_SIZE = 512
 
+ACCESS_LOG_DROPPED = Counter(
+    "gateway_access_log_dropped_total",
+    "Access log records dropped because the writer fell behind.",
+)
+ACCESS_LOG_WRITTEN = Counter(
+    "gateway_access_log_written_total",
+    "Access log records written.",
+)
 
-@app.get("/projects", dependencies=[Depends(verify_auth)])
-async def list_projects() -> list[Project]:
-    """List all projects in the home directory."""
-    projects = []
 
+def log_access(record: dict) -> None:
+    """Queue an access record; drop it rather than wait if the queue is full."""
     try:
-        for entry in HOME_DIR.iterdir():
-            if not entry.is_dir():
-                continue
-            if entry.name.startswith("."):
-                continue
+        access_log_queue.put_nowait(record)
+    except asyncio.QueueFull:
+        ACCESS_LOG_DROPPED.inc()
 
-            # Check for project indicators
-            has_git = (entry / ".git").exists()
-            has_package_json = (entry / "package.json").exists()
-
-            # Get running status
-            is_running, port = await get_service_status(entry.name)
-
-            projects.append(
-                Project(
-                    name=entry.name,
-                    path=str(entry),
-                    has_git=has_git,
-                    has_package_json=has_package_json,
-                    is_running=is_running,
-                    port=port,
-                )
-            )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to list projects: {e}")
 
-    # Sort by name
-    projects.sort(key=lambda p: p.name.lower())
-    return projects
+def open_access_log():
+    """Open the access log destination, returning a batch write function."""
+    if ACCESS_LOG == "-":
 
+        def write_stdout(text: str) -> None:
+            sys.stdout.write(text + "\n")
+            sys.stdout.flush()
 
-@app.post("/projects/{project_name}/start", dependencies=[Depends(verify_auth)])
-async def start_project(project_name: str) -> StartResponse:
-    """Start an OpenCode instance for a project."""
-    # Validate project exists
-    project_path = HOME_DIR / project_name
-    if not project_path.exists() or not project_path.is_dir():
-        raise HTTPException(
-            status_code=404, detail=f"Project not found: {project_name}"
-        )
+        return write_stdout
 
-    # Check if already running
-    is_running, port = await get_service_status(project_name)
-    if is_running and port:
-        return StartResponse(name=project_name, port=port, status="already_running")
+    handler = logging.handlers.RotatingFileHandler(
+        ACCESS_LOG, maxBytes=ACCESS_LOG_MAX_BYTES, backupCount=ACCESS_LOG_BACKUPS
+    )
 
-    # Start the service
-    service = get_service_name(project_name)
-    returncode, stdout, stderr = await run_systemctl("start", service)
+    def write_file(text: str) -> None:
+        handler.emit(logging.makeLogRecord({"msg": text}))
 
-    if returncode != 0:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to start service: {stderr or stdout}"
-        )
+    return write_file
 
-    # Wait for port
-    port = await wait_for_port(project_name)
-    if not port:
-        raise HTTPException(
-            status_code=500,
-            detail="Service started but failed to get port. Check logs with: journalctl --user -u "
-            + service,
-        )
 
-    running_instances[project_name] = port
-    return StartResponse(name=project_name, port=port, status="started")
+async def access_log_writer() -> None:
+    """Batch queued access records to the log off the event loop."""
+    write = await asyncio.to_thread(open_access_log)
+    batch: list[dict] = []
+    try:
+        while True:
+            batch.append(await access_log_queue.get())
+            while len(batch) < ACCESS_LOG_BATCH_SIZE and not access_log_queue.empty():
+                batch.append(access_log_queue.get_nowait())
 
+            text = "\n".join(json.dumps(record) for record in batch)
+            try:
+                await asyncio.to_thread(write, text)
+                ACCESS_LOG_WRITTEN.inc(amount=len(batch))
+            except OSError as e:
+                ACCESS_LOG_DROPPED.inc(amount=len(batch))
+                print(f"Warning: Failed to write access log: {e}")
+            batch.clear()
+    except asyncio.CancelledError:
+        # Flush what is left on shutdown
+        while not access_log_queue.empty():
+            batch.append(access_log_queue.get_nowait())
+        if batch:
+            write("\n".join(json.dumps(record) for record in batch))
+        raise
 
-@app.delete("/projects/{project_name}/stop", dependencies=[Depends(verify_auth)])
-async def stop_project(project_name: str) -> StopResponse:
-    """Stop an OpenCode instance for a project."""
-    service = get_service_name(project_name)
-    returncode, stdout, stderr = await run_systemctl("stop", service)
 
-    if returncode != 0:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to stop service: {stderr or stdout}"
-        )
+# =============================================================================
+# Models
+# =============================================================================
 
-    # Remove from tracking
-    running_instances.pop(project_name, None)
-    return StopResponse(name=project_name, status="stopped")
 
+class InstanceState(str, Enum):
+    STOPPED = "stopped"
+    STARTING = "starting"
+    READY = "ready"
+    DRAINING = "draining"
+    FAILED = "failed"
 
-@app.get("/projects/{project_name}/status", dependencies=[Depends(verify_auth)])
-async def project_status(project_name: str) -> Project:
-    """Get status of a specific project."""
-    project_path = HOME_DIR / project_name
-    if not project_path.exists() or not project_path.is_dir():
-        raise HTTPException(
-            status_code=404, detail=f"Project not found: {project_name}"
-        )
 
-    is_running, port = await get_service_status(project_name)
+class InstanceInfo(BaseModel):
+    name: str
+    state: InstanceState
+    port: Optional[int] = None
+    socket: Optional[str] = None
+    since: float
+    started_at: Optional[float] = None
+    reason: Optional[str] = None
+
 
-    return Project(
-        name=project_name,
-        path=str(project_path),
-        has_git=(project_path / ".git").exists(),
-        has_package_json=(project_path / "package.json").exists(),
-        is_running=is_running,
-        port=port,
+class ResourceSample(BaseModel):
+    timestamp: float
+    memory_current: int
+    memory_peak: Optional[int] = None
+    cpu_usage_usec: int
+    cpu_percent: Optional[float] = None
+    pids_current: Optional[int] = None
+
+
+class ResourceHistory(BaseModel):
+    name: str
+    samples: list[ResourceSample]
+
+
+class ProjectMetadata(BaseModel):
+    branch: Optional[str] = None
+    dirty: Optional[bool] = None
+    last_commit_at: Optional[float] = None
+    modified_at: Optional[float] = None
+    toolchains: list[str] = []
+    size_bytes: Optional[int] = None
+    size_complete: bool = True
+    collected_at: float
+
+
+class Project(BaseModel):
+    name: str
+    path: str
+    has_git: bool
+    has_package_json: bool
+    is_running: bool
+    port: Optional[int] = None
+    socket: Optional[str] = None
+    state: InstanceState = InstanceState.STOPPED
+    resources: Optional[ResourceSample] = None
+    metadata: Optional[ProjectMetadata] = None
+
+
+class ResourceLimits(BaseModel):
+    memory_max: Optional[str] = Field(
+        default=None, pattern=r"^(\d+[KMGT]?|\d+%|infinity)$", examples=["4G"]
+    )
+    cpu_quota: Optional[str] = Field(default=None, pattern=r"^\d+%$", examples=["300%"])
+    allowed_cpus: Optional[str] = Field(
+        default=None, pattern=r"^\d+(-\d+)?(,\d+(-\d+)?)*$", examples=["0-3"]
     )
 
 
-@app.api_route(
-    "/projects/{project_name}/api/{path:path}",
-    methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
-    dependencies=[Depends(verify_auth)],
-)
-async def proxy_to_opencode(project_name: str, path: str, request: Request) -> Response:
-    """Proxy requests to the OpenCode instance."""
-    # Get the port for this project
-    is_running, port = await get_service_status(project_name)
+class ModelPerformance(BaseModel):
+    provider_id: str
+    model_id: str
+    generations: int
+    errors: int
+    ttft_p50: Optional[float] = None
+    ttft_p95: Optional[float] = None
+    duration_p50: Optional[float] = None
+    duration_p95: Optional[float] = None
+    chars_per_second: Optional[float] = None
+    tokens_per_second: Optional[float] = None
 
-    if not is_running or not port:
-        raise HTTPException(
-            status_code=503,
-            detail=f"OpenCode instance for {project_name} is not running. Start it first.",
-        )
 
-    # Build the target URL
-    target_url = f"http://127.0.0.1:{port}/{path}"
-    if request.url.query:
-        target_url += f"?{request.url.query}"
+class LoopStall(BaseModel):
+    at: float
+    duration_ms: float
+    stack: list[str]
 
-    # Get request body if present
-    body = await request.body()
 
-    # Forward headers (except Host and Authorization which we handle)
-    headers = dict(request.headers)
-    headers.pop("host", None)
-    headers.pop("authorization", None)
+class LoopStatus(BaseModel):
+    lag_ms: Optional[float] = None
+    lag_p50_ms: Optional[float] = None
+    lag_p99_ms: Optional[float] = None
+    lag_max_ms: Optional[float] = None
+    slow_callback_threshold_ms: float
+    stalls: list[LoopStall]
 
-    # Check if this is an SSE request
-    accept = headers.get("accept", "")
-    is_sse = "text/event-stream" in accept or path == "event"
 
-    if is_sse:
+class StartResponse(BaseModel):
+    name: str
+    port: Optional[int] = None
+    socket: Optional[str] = None
+    status: str
 
-        async def stream_sse():
-            async with httpx.AsyncClient() as client:
-                try:
-                    async with client.stream(
-                        request.method,
-                        target_url,
-                        headers=headers,
-                        content=body,
-                        timeout=None,
-                    ) as response:
-                        async for chunk in response.aiter_bytes():
-                            yield chunk
-                except Exception as e:
-                    print(f"SSE Stream Error: {e}")
-
-        return StreamingResponse(
-            stream_sse(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            },
-        )
-    else:
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.request(
-                    request.method,
-                    target_url,
-                    headers=headers,
-                    content=body,
-                    timeout=60.0,
-                )
 
-                return Response(
-                    content=response.content,
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                )
-        except httpx.ConnectError:
-            raise HTTPException(
-                status_code=503,
-                detail=f"Cannot connect to OpenCode instance on port {port}",
-            )
-        except Exception as e:
-            raise HTTPException(status_code=502, detail=f"Proxy error: {str(e)}")
+class StopResponse(BaseModel):
+    name: str
+    status: str
+    drained: bool = False
+
+
+class Readiness(BaseModel):
+    ready: bool
+    instances_registered: int
+    instances_validated: int
+
+
+class EventBatch(BaseModel):
+    cursor: str
+    events: list[dict]
+    more: bool = False
+    reset: bool = False
 
 
 # =============================================================================
-# Startup
+# Shared State
 # =============================================================================
 
+# Every worker keeps its state in memory and appends its changes to a log in
+# an SQLite database; the others poll the log and apply them. The latest state
+# of every instance is kept as the instance registry, which workers load at
+# startup so a restarted gateway knows its instances without asking systemd.
+SHARED_STATE_DB = STATE_DIR / "gateway.db"
+SHARED_STATE_RETENTION = 300.0  # Seconds of changes kept for slow workers
+SHARED_STATE_PRUNE_INTERVAL = 60.0
+LOCK_POLL_INTERVAL = 0.05
+LEADER_RETRY_INTERVAL = 5.0
+# Workers note they are alive; one silent for WORKER_TIMEOUT is gone
+WORKER_HEARTBEAT_INTERVAL = 2.0
+WORKER_TIMEOUT = 3 * WORKER_HEARTBEAT_INTERVAL
 
-@app.on_event("startup")
-async def startup_event():
-    """Discover already-running instances on startup."""
-    print(f"VibeRemote Gateway starting...")
-    print(f"Home directory: {HOME_DIR}")
-    print(
-        f"Auth secret configured: {'Yes' if AUTH_SECRET != 'change-me-in-production' else 'NO - USING DEFAULT!'}"
-    )
+# Marks this worker's own changes in the log. The pid alone is not unique:
+# containers sharing a STATE_DIR all number their processes from 1
+worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
 
-    # Scan for running instances
-    try:
-        for entry in HOME_DIR.iterdir():
-            if not entry.is_dir() or entry.name.startswith("."):
-                continue
+# Apply another worker's change: kind -> handler(name, data)
+shared_state_handlers: dict = {}
 
-            is_running, port = await get_service_status(entry.name)
-            if is_running and port:
-                running_instances[entry.name] = port
-                print(f"  Found running: {entry.name} on port {port}")
-    except Exception as e:
-        print(f"Warning: Failed to scan for running instances: {e}")
+# The connection is only used from this thread, so writes keep their order
+shared_state_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="shared-state"
+)
+shared_state_db: Optional[sqlite3.Connection] = None
+shared_state_sync_lock = asyncio.Lock()
+last_change_seq = 0
 
-    print(f"Gateway ready. Found {len(running_instances)} running instance(s).")
+# Other live workers, as of the last heartbeat
+other_workers: list[str] = []
 
+# Whether this worker runs the once-per-host work (see leader_loop)
+is_leader = False
+
+SHARED_STATE_CHANGES = Counter(
+    "gateway_shared_state_changes_total",
+    "Shared state changes written by this worker or applied from others.",
+    ("kind", "origin"),
+)
 
-if __name__ == "__main__":
-    import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=4000)
+def open_shared_state() -> list[tuple[str, str]]:
+    """Open the database; returns the instance registry as (name, json)."""
+    global shared_state_db, last_change_seq
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    (STATE_DIR / "locks").mkdir(exist_ok=True)
+    db = sqlite3.connect(SHARED_STATE_DB, timeout=10.0, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " origin TEXT, kind TEXT, name TEXT, data TEXT, at REAL)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS instances (name TEXT PRIMARY KEY, data TEXT)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, started REAL,"
+        " seen REAL)"
+    )
+    db.execute("BEGIN")
+    try:
+        last_change_seq = db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM changes"
+        ).fetchone()[0]
+        snapshot = db.execute("SELECT name, data FROM instances").fetchall()
+    finally:
+        db.execute("COMMIT")
+    shared_state_db = db
+    return snapshot
+
+
+def write_change(kind: str, name: str, data: str, at: float) -> None:
+    try:
+        with shared_state_db:
+            shared_state_db.execute(
+                "INSERT INTO changes (origin, kind, name, data, at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (worker_id, kind, name, data, at),
+            )
+            if kind == "instance":
+                shared_state_db.execute(
+                    "INSERT OR REPLACE INTO instances (name, data) VALUES (?, ?)",
+                    (name, data),
+                )
+    except sqlite3.Error as e:
+        print(f"Warning: Failed to share {kind} change of {name}: {e}")
+
+
+def read_changes(after: int) -> list[tuple]:
+    return shared_state_db.execute(
+        "SELECT seq, origin, kind, name, data FROM changes WHERE seq > ? ORDER BY seq",
+        (after,),
+    ).fetchall()
+
+
+def prune_changes(before: float) -> None:
+    with shared_state_db:
+        shared_state_db.execute("DELETE FROM changes WHERE at < ?", (before,))
+        shared_state_db.execute(
+            "DELETE FROM workers WHERE seen < ?", (time.time() - WORKER_TIMEOUT,)
+        )
+
+
+def write_heartbeat(at: float) -> None:
+    with shared_state_db:
+        shared_state_db.execute(
+            "INSERT INTO workers (id, started, seen) VALUES (?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET seen = excluded.seen",
+            (worker_id, at, at),
+        )
+
+
+def forget_worker() -> None:
+    with shared_state_db:
+        shared_state_db.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+
+def read_other_workers(started_before: float) -> list[str]:
+    """Live workers other than this one that started before a given time."""
+    rows = shared_state_db.execute(
+        "SELECT id FROM workers WHERE id != ? AND started < ? AND seen > ?",
+        (worker_id, started_before, time.time() - WORKER_TIMEOUT),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def sharing_state() -> bool:
+    """Whether changes are exchanged with other workers."""
+    return SHARED_STATE and shared_state_db is not None
+
+
+def publish_change(kind: str, name: str, data) -> None:
+    """Share a change with the other workers (in the background, in order).
+
+    Instance changes are written even when not sharing, for the registry.
+    """
+    if shared_state_db is None or (kind != "instance" and not SHARED_STATE):
+        return
+    SHARED_STATE_CHANGES.inc((kind, "local"))
+    shared_state_executor.submit(
+        write_change, kind, name, json.dumps(data), time.time()
+    )
+
+
+async def sync_shared_state() -> None:
+    """Apply the changes other workers made since the last sync."""
+    global last_change_seq
+    if shared_state_db is None:
+        return
+    loop = asyncio.get_running_loop()
+    async with shared_state_sync_lock:
+        rows = await loop.run_in_executor(
+            shared_state_executor, read_changes, last_change_seq
+        )
+        for seq, origin, kind, name, data in rows:
+            last_change_seq = seq
+            handler = shared_state_handlers.get(kind)
+            if origin == worker_id or handler is None:
+                continue
+            SHARED_STATE_CHANGES.inc((kind, "remote"))
+            try:
+                handler(name, json.loads(data))
+            except Exception as e:
+                print(f"Warning: Failed to apply {kind} change of {name}: {e}")
+
+
+async def shared_state_loop() -> None:
+    global other_workers
+    loop = asyncio.get_running_loop()
+    next_heartbeat = 0.0
+    while True:
+        try:
+            if loop.time() >= next_heartbeat:
+                next_heartbeat = loop.time() + WORKER_HEARTBEAT_INTERVAL
+                await loop.run_in_executor(
+                    shared_state_executor, write_heartbeat, time.time()
+                )
+                other_workers = await loop.run_in_executor(
+                    shared_state_executor, read_other_workers, time.time()
+                )
+            await sync_shared_state()
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to read shared state: {e}")
+        await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+
+
+async def prune_loop() -> None:
+    """Drop changes every worker has had time to apply (leader only)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(SHARED_STATE_PRUNE_INTERVAL)
+        try:
+            await loop.run_in_executor(
+                shared_state_executor,
+                prune_changes,
+                time.time() - SHARED_STATE_RETENTION,
+            )
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to prune shared state: {e}")
+
+
+async def acquire_file_lock(path: Path) -> int:
+    """Open a lock file and take an exclusive flock on it; returns the fd."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+@contextlib.asynccontextmanager
+async def project_lock(project_name: str):
+    """Serialize starts and stops of a project across tasks and workers."""
+    async with start_locks.setdefault(project_name, asyncio.Lock()):
+        if not sharing_state():
+            yield
+            return
+
+        name = sanitize_project_name(project_name)
+        fd = await acquire_file_lock(STATE_DIR / "locks" / f"{name}.lock")
+        try:
+            # See what the previous holder did before deciding anything
+            await sync_shared_state()
+            yield
+        finally:
+            os.close(fd)
+
+
+async def leader_loop() -> None:
+    """Run the once-per-host background work in a single worker.
+
+    The worker holding the leader lock pre-warms, reconciles and prunes the
+    change log; if it exits, another worker takes over within seconds.
+    """
+    global is_leader
+    fd = None
+    if sharing_state():
+        fd = os.open(STATE_DIR / "leader.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        while fd is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                print(f"Worker {worker_id} runs warm-up and reconciliation")
+                break
+            except BlockingIOError:
+                await asyncio.sleep(LEADER_RETRY_INTERVAL)
+
+        is_leader = True
+        tasks = [warmup_loop(), reconcile_loop()]
+        if shared_state_db is not None:
+            tasks.append(prune_loop())
+        await asyncio.gather(*tasks)
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+# =============================================================================
+# Instance Lifecycle
+# =============================================================================
+
+# Single source of truth for instances: project_name -> lifecycle record
+instances: dict[str, InstanceInfo] = {}
+
+# Where a ready instance listens: a TCP port on loopback or a Unix socket path
+Address = Union[int, str]
+
+# Clients of /instances/events, each fed every transition
+instance_subscribers: set[asyncio.Queue] = set()
+
+INSTANCE_EVENTS_HEARTBEAT = 10.0
+
+INSTANCES_BY_STATE = Gauge(
+    "gateway_instances",
+    "Known instances by lifecycle state.",
+    ("state",),
+    collect=lambda: {
+        (state.value,): sum(1 for i in instances.values() if i.state == state)
+        for state in InstanceState
+    },
+)
+INSTANCE_EVENT_SUBSCRIBERS = Gauge(
+    "gateway_instance_event_subscribers",
+    "Open /instances/events streams.",
+    collect=lambda: {(): len(instance_subscribers)},
+)
+
+ALLOWED_TRANSITIONS: dict[InstanceState, set[InstanceState]] = {
+    InstanceState.STOPPED: {
+        InstanceState.STARTING,
+        InstanceState.READY,
+        InstanceState.FAILED,
+    },
+    InstanceState.STARTING: {
+        InstanceState.READY,
+        InstanceState.FAILED,
+        InstanceState.STOPPED,
+    },
+    InstanceState.READY: {
+        InstanceState.DRAINING,
+        InstanceState.FAILED,
+        InstanceState.STOPPED,
+    },
+    InstanceState.DRAINING: {InstanceState.STOPPED, InstanceState.FAILED},
+    InstanceState.FAILED: {
+        InstanceState.STARTING,
+        InstanceState.READY,
+        InstanceState.DRAINING,
+        InstanceState.STOPPED,
+    },
+}
+
+# States during which a start or stop owns the instance
+BUSY_STATES = {InstanceState.STARTING, InstanceState.DRAINING}
+
+# States that hold an instance slot
+ACTIVE_STATES = {InstanceState.STARTING, InstanceState.READY, InstanceState.DRAINING}
+
+
+def get_instance_state(project_name: str) -> InstanceState:
+    """Current lifecycle state of a project's instance."""
+    instance = instances.get(project_name)
+    return instance.state if instance else InstanceState.STOPPED
+
+
+def instance_address(instance: Optional[InstanceInfo]) -> Optional[Address]:
+    if instance is None:
+        return None
+    return instance.socket or instance.port
+
+
+def get_ready_address(project_name: str) -> Optional[Address]:
+    """Address of a project's instance if it is ready to serve requests."""
+    instance = instances.get(project_name)
+    if instance is None or instance.state != InstanceState.READY:
+        return None
+    return instance_address(instance)
+
+
+def known_service_status(project_name: str) -> tuple[bool, Optional[Address]]:
+    """Like get_service_status, from the instance state alone (no systemd call).
+
+    The reconcile loop keeps the states in line with systemd.
+    """
+    instance = instances.get(project_name)
+    if instance is None or instance.state not in ACTIVE_STATES:
+        return False, None
+    return True, instance_address(instance)
+
+
+def describe_address(address: Address) -> str:
+    return f"socket {address}" if isinstance(address, str) else f"port {address}"
+
+
+def count_active_instances() -> int:
+    """Number of instances that are starting, ready or draining."""
+    return sum(1 for i in instances.values() if i.state in ACTIVE_STATES)
+
+
+def set_instance_state(
+    project_name: str,
+    state: InstanceState,
+    address: Optional[Address] = None,
+    reason: Optional[str] = None,
+) -> InstanceInfo:
+    """Move an instance to a new state and publish the transition."""
+    previous = get_instance_state(project_name)
+    if state != previous and state not in ALLOWED_TRANSITIONS[previous]:
+        raise ValueError(
+            f"Invalid transition for {project_name}: {previous.value} -> {state.value}"
+        )
+
+    now = time.time()
+    old = instances.get(project_name)
+    started_at = old.started_at if old else None
+    if state == InstanceState.STARTING or (
+        state == InstanceState.READY and previous != InstanceState.STARTING
+    ):
+        started_at = now
+    elif state in (InstanceState.STOPPED, InstanceState.FAILED):
+        started_at = None
+
+    if state not in (InstanceState.READY, InstanceState.DRAINING):
+        address = None
+    instance = InstanceInfo(
+        name=project_name,
+        state=state,
+        port=address if isinstance(address, int) else None,
+        socket=address if isinstance(address, str) else None,
+        since=now,
+        started_at=started_at,
+        reason=reason,
+    )
+    instances[project_name] = instance
+    publish_change("instance", project_name, instance.model_dump(mode="json"))
+    notify_instance_subscribers(instance, previous)
+    return instance
+
+
+def notify_instance_subscribers(
+    instance: InstanceInfo, previous: InstanceState
+) -> None:
+    if instance.state in (InstanceState.STOPPED, InstanceState.FAILED):
+        # A stream still open belongs to a process on its way out
+        stop_event_watcher(instance.name)
+        busy_sessions.pop(instance.name, None)
+
+    event = {
+        "type": "instance.state",
+        "properties": {
+            **instance.model_dump(mode="json"),
+            "previous": previous.value,
+        },
+    }
+    for queue in instance_subscribers:
+        queue.put_nowait(event)
+    for channel in event_channels:
+        channel.push(event)
+
+
+def apply_instance_change(project_name: str, data: dict) -> None:
+    """Take over a transition made by another worker."""
+    previous = get_instance_state(project_name)
+    instance = InstanceInfo(**data)
+    instances[project_name] = instance
+    notify_instance_subscribers(instance, previous)
+    if instance.state == InstanceState.DRAINING and previous != instance.state:
+        # The draining worker waits on our requests and streams too
+        spawn_background(report_drain_activity(project_name))
+
+
+def load_instance_registry(registry: list[tuple[str, str]]) -> None:
+    """Seed the instances from the registry at startup (trusted until validated)."""
+    for project_name, data in registry:
+        instance = InstanceInfo(**json.loads(data))
+        if instance.state in BUSY_STATES:
+            # Possibly left behind by a worker that exited mid-start or -stop;
+            # a live one publishes the outcome, otherwise validation asks systemd
+            instance.state = InstanceState.FAILED
+            instance.reason = "Interrupted start or stop of another worker"
+        instances[project_name] = instance
+
+
+shared_state_handlers["instance"] = apply_instance_change
+
+
+# =============================================================================
+# Helper Functions
+# =============================================================================
+
+
+def sanitize_project_name(name: str) -> str:
+    """Sanitize project name for use in systemd service names."""
+    # Only allow alphanumeric, dash, underscore
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+
+
+def get_service_name(project_name: str) -> str:
+    """Get systemd service name for a project."""
+    return f"opencode@{sanitize_project_name(project_name)}"
+
+
+async def run_systemctl(action: str, *args: str) -> tuple[int, str, str]:
+    """Run a systemctl --user command."""
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        "systemctl",
+        "--user",
+        action,
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await proc.communicate()
+    SUBPROCESS_DURATION.observe(("systemctl", action), time.perf_counter() - start)
+    return proc.returncode, stdout.decode(), stderr.decode()
+
+
+async def get_service_status(project_name: str) -> tuple[bool, Optional[Address]]:
+    """Check if a service is running and get its address.
+
+    The answer from systemd is folded into the instance state, so units
+    started, stopped or restarted outside the gateway are picked up here.
+    """
+    start = time.perf_counter()
+    try:
+        return await sync_service_status(project_name)
+    finally:
+        record_timing("status", time.perf_counter() - start)
+
+
+async def sync_service_status(project_name: str) -> tuple[bool, Optional[Address]]:
+    """Ask systemd about a service and fold the answer into its state."""
+    service = get_service_name(project_name)
+    returncode, stdout, _ = await run_systemctl("is-active", service)
+
+    is_running = returncode == 0
+    instance = instances.get(project_name)
+    state = instance.state if instance else InstanceState.STOPPED
+    address = instance_address(instance)
+
+    # A start or stop in progress owns the state
+    if state in BUSY_STATES:
+        return is_running, address
+
+    if is_running:
+        if state == InstanceState.READY:
+            return True, address
+
+        # Running but we don't know where it listens: its socket or its logs
+        address = get_instance_socket(project_name)
+        if address is None or not os.path.exists(address):
+            address = await find_port_from_logs(project_name)
+        if address:
+            set_instance_state(
+                project_name,
+                InstanceState.READY,
+                address=address,
+                reason="Discovered running service",
+            )
+        return True, address
+
+    unit_state = stdout.strip()
+    if unit_state in ("failed", "activating"):
+        # "activating" while not active means systemd is restarting it
+        if state != InstanceState.FAILED:
+            set_instance_state(
+                project_name,
+                InstanceState.FAILED,
+                reason=f"Service is {unit_state}",
+            )
+    elif state != InstanceState.STOPPED:
+        set_instance_state(
+            project_name, InstanceState.STOPPED, reason=f"Service is {unit_state}"
+        )
+    return False, None
+
+
+async def find_port_from_logs(project_name: str) -> Optional[int]:
+    """Find the port from journalctl logs."""
+    service = get_service_name(project_name)
+    start = time.perf_counter()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "journalctl",
+            "--user",
+            "-u",
+            service,
+            "-n",
+            "50",
+            "--no-pager",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, _ = await proc.communicate()
+        SUBPROCESS_DURATION.observe(("journalctl", "read"), time.perf_counter() - start)
+        output = stdout.decode()
+
+        # Look for "listening on http://127.0.0.1:XXXXX"
+        # Use findall and take the LAST match to ensure we get the most recent port
+        # journalctl outputs logs chronologically (oldest first), so the last match is the newest
+        matches = re.findall(r"listening on http://[^:]+:(\d+)", output)
+        if matches:
+            return int(matches[-1])
+    except Exception:
+        pass
+    return None
+
+
+def get_instance_socket(project_name: str) -> Optional[str]:
+    """Path an instance listens on if it binds a Unix socket (may not exist)."""
+    if not INSTANCE_SOCKET_DIR:
+        return None
+    return os.path.join(
+        INSTANCE_SOCKET_DIR, f"{sanitize_project_name(project_name)}.sock"
+    )
+
+
+async def wait_for_address(
+    project_name: str, timeout: float = 30.0
+) -> Optional[Address]:
+    """Wait for the service to start listening on its socket or a port."""
+    start_time = asyncio.get_event_loop().time()
+    socket_path = get_instance_socket(project_name)
+
+    while asyncio.get_event_loop().time() - start_time < timeout:
+        # The socket needs no log scraping; a port is the fallback
+        if socket_path and os.path.exists(socket_path):
+            if await instance_answers(socket_path):
+                return socket_path
+        port = await find_port_from_logs(project_name)
+        # Verify the port is actually responding
+        if port and await instance_answers(port):
+            return port
+        await asyncio.sleep(0.5)
+
+    return None
+
+
+async def launch_instance(
+    project_name: str, reason: Optional[str] = None
+) -> StartResponse:
+    """Start the service for a project unless it is already running.
+
+    reason is recorded with the ready state (see WARMUP_REASON).
+    """
+    async with project_lock(project_name):
+        # Check if already running
+        await get_service_status(project_name)
+        address = get_ready_address(project_name)
+        if address:
+            return start_response(project_name, address, "already_running")
+
+        set_instance_state(project_name, InstanceState.STARTING)
+        try:
+            # Start the service with its resource overrides in place
+            service = get_service_name(project_name)
+            limits = get_resource_limits(project_name)
+            if limits is not None:
+                returncode, stdout, stderr = await apply_resource_limits(
+                    service, limits
+                )
+                if returncode != 0:
+                    print(
+                        f"Warning: Failed to apply limits to {service}: {stderr or stdout}"
+                    )
+
+            returncode, stdout, stderr = await run_systemctl("start", service)
+
+            if returncode != 0:
+                set_instance_state(
+                    project_name, InstanceState.FAILED, reason=stderr or stdout
+                )
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to start service: {stderr or stdout}",
+                )
+
+            # Wait for its socket or port
+            address = await wait_for_address(project_name)
+            if not address:
+                set_instance_state(
+                    project_name,
+                    InstanceState.FAILED,
+                    reason="Service started but did not report a healthy port",
+                )
+                raise HTTPException(
+                    status_code=500,
+                    detail="Service started but failed to get port. Check logs with: journalctl --user -u "
+                    + service,
+                )
+
+            set_instance_state(
+                project_name, InstanceState.READY, address=address, reason=reason
+            )
+            return start_response(project_name, address, "started")
+        except BaseException as e:
+            # Never leave the instance in STARTING: nothing would own it
+            if get_instance_state(project_name) == InstanceState.STARTING:
+                set_instance_state(
+                    project_name,
+                    InstanceState.FAILED,
+                    reason=f"Start interrupted: {e!r}",
+                )
+            raise
+
+
+def start_response(project_name: str, address: Address, status: str) -> StartResponse:
+    if isinstance(address, str):
+        return StartResponse(name=project_name, socket=address, status=status)
+    return StartResponse(name=project_name, port=address, status=status)
+
+
+async def reconcile_loop() -> None:
+    """Periodically check instances against systemd, and look for new units."""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        for project_name, instance in list(instances.items()):
+            if instance.state not in (InstanceState.READY, InstanceState.FAILED):
+                continue
+            try:
+                await get_service_status(project_name)
+            except Exception as e:
+                print(f"Warning: Failed to check {project_name}: {e}")
+        try:
+            await discover_running_units()
+        except Exception as e:
+            print(f"Warning: Failed to discover running units: {e}")
+
+
+# Startup validation of the instance registry (see /ready)
+registry_validation = {"registered": 0, "validated": 0, "done": False}
+
+VALIDATE_CONCURRENCY = 16
+
+
+async def instance_answers(address: Address) -> bool:
+    """Check that an instance answers its health endpoint."""
+    client, base_url = upstream(address)
+    try:
+        resp = await client.get(f"{base_url}/global/health", timeout=2.0)
+        return resp.status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+async def validate_instance(project_name: str) -> None:
+    """Check a registry entry against systemd and the instance itself."""
+    is_running, address = await get_service_status(project_name)
+    if not (is_running and address) or await instance_answers(address):
+        return
+
+    # The unit restarted on another port while the gateway was down
+    if get_ready_address(project_name) == address:
+        set_instance_state(
+            project_name,
+            InstanceState.FAILED,
+            reason=f"{describe_address(address).capitalize()} did not answer "
+            "after gateway restart",
+        )
+    await get_service_status(project_name)
+
+
+async def discover_running_units() -> None:
+    """Pick up instances that were started while the gateway was down."""
+    returncode, stdout, stderr = await run_systemctl(
+        "list-units", "opencode@*", "--state=active", "--no-legend", "--plain"
+    )
+    if returncode != 0:
+        print(f"Warning: Failed to list running units: {stderr or stdout}")
+        return
+
+    by_unit = {f"{get_service_name(name)}.service": name for name in project_index}
+    names = [
+        by_unit[line.split()[0]]
+        for line in stdout.splitlines()
+        if line.strip() and line.split()[0] in by_unit
+    ]
+    await asyncio.gather(
+        *(
+            get_service_status(name)
+            for name in names
+            if get_instance_state(name) != InstanceState.READY
+        )
+    )
+
+
+async def validate_registry() -> None:
+    """Validate the loaded registry concurrently, then look for new units.
+
+    Requests are served meanwhile: a registered port is used as is, and a
+    stale one is rediscovered when connecting to it fails.
+    """
+    names = [
+        name
+        for name, instance in instances.items()
+        if instance.state != InstanceState.STOPPED
+    ]
+    registry_validation["registered"] = len(names)
+    semaphore = asyncio.Semaphore(VALIDATE_CONCURRENCY)
+
+    async def validate(project_name: str) -> None:
+        async with semaphore:
+            try:
+                await validate_instance(project_name)
+            except Exception as e:
+                print(f"Warning: Failed to validate {project_name}: {e}")
+            registry_validation["validated"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(validate(name) for name in names))
+    try:
+        await discover_running_units()
+    except Exception as e:
+        print(f"Warning: Failed to discover running units: {e}")
+    registry_validation["done"] = True
+    print(
+        f"Validated {len(names)} registered instance(s) in "
+        f"{time.perf_counter() - started:.1f}s; "
+        f"{count_active_instances()} running"
+    )
+
+
+# Per-project resource overrides: project_name -> ResourceLimits fields
+resource_limits: dict[str, dict] = {}
+
+# ResourceLimits field -> unit property it overrides
+LIMIT_PROPERTIES = {
+    "memory_max": "MemoryMax",
+    "cpu_quota": "CPUQuota",
+    "allowed_cpus": "AllowedCPUs",
+}
+
+
+def apply_limits_change(project_name: str, overrides: dict) -> None:
+    if overrides:
+        resource_limits[project_name] = overrides
+    else:
+        resource_limits.pop(project_name, None)
+
+
+shared_state_handlers["limits"] = apply_limits_change
+
+
+def get_resource_limits(project_name: str) -> Optional[ResourceLimits]:
+    """Get the resource overrides configured for a project."""
+    overrides = resource_limits.get(project_name)
+    return ResourceLimits(**overrides) if overrides else None
+
+
+async def apply_resource_limits(
+    service: str, limits: ResourceLimits
+) -> tuple[int, str, str]:
+    """Set resource limits on a unit as transient (--runtime) properties."""
+    properties = [
+        f"{LIMIT_PROPERTIES[field]}={value}"
+        for field, value in limits.model_dump(exclude_none=True).items()
+    ]
+    if not properties:
+        return 0, "", ""
+
+    return await run_systemctl("set-property", service, "--runtime", *properties)
+
+
+def runtime_control_dir(service: str) -> Path:
+    """Where set-property --runtime writes a unit's drop-ins."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
+    return Path(runtime_dir) / "systemd" / "user.control" / f"{service}.service.d"
+
+
+async def clear_resource_limits(service: str, fields) -> tuple[int, str, str]:
+    """Return properties to the template's values by removing their drop-ins.
+
+    Only the drop-ins apply_resource_limits wrote are removed; systemctl
+    revert would also delete the administrator's own. (An empty set-property
+    is no reset: it writes "infinity", overriding the template too.)
+    """
+    directory = runtime_control_dir(service)
+    paths = [directory / f"50-{LIMIT_PROPERTIES[field]}.conf" for field in fields]
+    if not paths:
+        return 0, "", ""
+
+    def remove_dropins() -> None:
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    try:
+        await asyncio.to_thread(remove_dropins)
+    except OSError as e:
+        return 1, "", str(e)
+    return await run_systemctl("daemon-reload")
+
+
+async def record_resource_limits(project_name: str, overrides: dict) -> None:
+    """Store a project's overrides, share them and persist them."""
+    apply_limits_change(project_name, overrides)
+    publish_change("limits", project_name, overrides)
+    await asyncio.to_thread(save_state, "limits.json", resource_limits)
+
+
+def load_state(filename: str) -> Optional[dict]:
+    """Load a JSON state file from STATE_DIR, or None if missing/unreadable."""
+    try:
+        return json.loads((STATE_DIR / filename).read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Warning: Failed to load {filename}: {e}")
+        return None
+
+
+def save_state(filename: str, data: dict) -> None:
+    """Atomically write a JSON state file to STATE_DIR."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = STATE_DIR / filename
+    # Workers write the same files: each needs a temporary file of its own
+    tmp_path = path.with_name(f".{path.name}.{worker_id}.tmp")
+    try:
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine for the lifetime of the app."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# =============================================================================
+# Project Index
+# =============================================================================
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+HOME_WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+)
+PROJECT_WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+)
+GIT_WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_CLOSE_WRITE
+
+# Entries of a project root whose presence the index tracks
+PROJECT_MARKERS = (".git", "package.json")
+
+PROJECT_SCAN_DELAY = 0.1  # Coalesce bursts of events (git clone, cp -r)
+PROJECT_RESCAN_INTERVAL = 300  # Full rescan behind inotify, for missed events
+
+
+class Inotify:
+    """Minimal inotify(7) binding over ctypes."""
+
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """Pending events as (watch descriptor, mask, name)."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+@dataclass
+class ProjectEntry:
+    """What the index knows about a project directory."""
+
+    name: str
+    path: Path
+    has_git: bool
+    has_package_json: bool
+
+
+# Discovered projects: project_name -> entry (served without touching the disk)
+project_index: dict[str, ProjectEntry] = {}
+
+# Called with the project name whenever its entry is added, changed or removed
+project_index_listeners: list = []
+
+# Called with (project_name, path) for files changing in a project root or its
+# .git directory (inotify only)
+project_change_listeners: list = []
+
+# Projects waiting to be rescanned; None stands for all of HOME_DIR
+pending_project_scans: set[Optional[str]] = set()
+project_scan_task: Optional[asyncio.Task] = None
+
+# inotify instance and watches (None when polling)
+inotify: Optional[Inotify] = None
+home_watch: Optional[int] = None
+project_watches: dict[int, str] = {}  # wd -> project_name
+project_watch_ids: dict[str, int] = {}  # project_name -> wd
+git_watches: dict[int, str] = {}  # wd of <project>/.git -> project_name
+git_watch_ids: dict[str, int] = {}  # project_name -> wd of <project>/.git
+
+
+def watch_project(name: str) -> None:
+    """Watch a project root for its markers appearing or disappearing."""
+    if inotify is None or name in project_watch_ids:
+        return
+    try:
+        wd = inotify.add_watch(HOME_DIR / name, PROJECT_WATCH_MASK | IN_ONLYDIR)
+    except OSError as e:
+        # Out of watches or gone again: the periodic rescan still covers it
+        print(f"Warning: Cannot watch project {name}: {e}")
+        return
+    project_watches[wd] = name
+    project_watch_ids[name] = wd
+
+
+def watch_git(name: str) -> None:
+    """Watch a project's .git directory (commits, checkouts, staging)."""
+    if inotify is None or name in git_watch_ids:
+        return
+    try:
+        wd = inotify.add_watch(HOME_DIR / name / ".git", GIT_WATCH_MASK | IN_ONLYDIR)
+    except OSError:
+        return  # Not a directory (worktree) or out of watches
+    git_watches[wd] = name
+    git_watch_ids[name] = wd
+
+
+def unwatch_project(name: str) -> None:
+    # A renamed directory keeps its watches, now registered under the new name
+    for ids, watches in (
+        (project_watch_ids, project_watches),
+        (git_watch_ids, git_watches),
+    ):
+        wd = ids.pop(name, None)
+        if wd is not None and watches.get(wd) == name:
+            del watches[wd]
+            inotify.rm_watch(wd)
+
+
+def scan_project(name: str) -> Optional[ProjectEntry]:
+    """Look at one directory on disk (blocking; run in a worker thread)."""
+    path = HOME_DIR / name
+    if name.startswith(".") or not path.is_dir():
+        return None
+    # Watch before looking, so a marker created in between is not missed
+    watch_project(name)
+    entry = ProjectEntry(
+        name=name,
+        path=path,
+        has_git=(path / ".git").exists(),
+        has_package_json=(path / "package.json").exists(),
+    )
+    if entry.has_git:
+        watch_git(name)
+    return entry
+
+
+def scan_home() -> dict[str, ProjectEntry]:
+    """Look at every directory in HOME_DIR (blocking; run in a worker thread)."""
+    entries = {}
+    for name in os.listdir(HOME_DIR):
+        entry = scan_project(name)
+        if entry is not None:
+            entries[name] = entry
+    return entries
+
+
+def update_project_index(entries: dict[str, Optional[ProjectEntry]]) -> None:
+    """Apply scan results (None removes a project) and notify listeners."""
+    for name, entry in entries.items():
+        previous = project_index.get(name)
+        if entry == previous:
+            continue
+        if entry is None:
+            del project_index[name]
+            if inotify is not None:
+                unwatch_project(name)
+        else:
+            project_index[name] = entry
+        for listener in project_index_listeners:
+            listener(name)
+
+
+def schedule_project_scan(name: Optional[str]) -> None:
+    """Rescan a project (or all of HOME_DIR with None) shortly, off the loop."""
+    global project_scan_task
+    pending_project_scans.add(name)
+    if project_scan_task is None or project_scan_task.done():
+        project_scan_task = spawn_background(run_project_scans())
+
+
+async def run_project_scans() -> None:
+    await asyncio.sleep(PROJECT_SCAN_DELAY)
+    while pending_project_scans:
+        names = set(pending_project_scans)
+        pending_project_scans.clear()
+        try:
+            if None in names:
+                scanned = await asyncio.to_thread(scan_home)
+                update_project_index(
+                    {**{name: None for name in project_index}, **scanned}
+                )
+            else:
+                update_project_index(
+                    await asyncio.to_thread(
+                        lambda: {name: scan_project(name) for name in names}
+                    )
+                )
+        except OSError as e:
+            print(f"Warning: Project scan failed: {e}")
+
+
+def read_project_events() -> None:
+    """Turn inotify events into rescans (runs on the loop when the fd is readable)."""
+    for wd, mask, name in inotify.read():
+        if mask & IN_Q_OVERFLOW:
+            schedule_project_scan(None)
+        elif wd == home_watch:
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                schedule_project_scan(None)
+            elif mask & IN_ISDIR:
+                schedule_project_scan(name)
+        elif wd in project_watches:
+            project = project_watches[wd]
+            if mask & IN_IGNORED:
+                # Directory deleted; the kernel already dropped the watch
+                project_watches.pop(wd, None)
+                project_watch_ids.pop(project, None)
+            else:
+                if name in PROJECT_MARKERS:
+                    schedule_project_scan(project)
+                for listener in project_change_listeners:
+                    listener(project, name)
+        elif wd in git_watches:
+            project = git_watches[wd]
+            if mask & IN_IGNORED:
+                git_watches.pop(wd, None)
+                git_watch_ids.pop(project, None)
+            elif not name.endswith(".lock"):
+                for listener in project_change_listeners:
+                    listener(project, f".git/{name}")
+
+
+async def project_index_loop() -> None:
+    """Rescan periodically: the only source of updates when polling."""
+    interval = PROJECT_POLL_INTERVAL if inotify is None else PROJECT_RESCAN_INTERVAL
+    while True:
+        await asyncio.sleep(interval)
+        schedule_project_scan(None)
+
+
+async def start_project_index() -> None:
+    """Build the index and keep it current with inotify or polling."""
+    global inotify, home_watch
+    if PROJECT_WATCH == "auto":
+        try:
+            inotify = Inotify()
+            home_watch = inotify.add_watch(HOME_DIR, HOME_WATCH_MASK | IN_ONLYDIR)
+        except (OSError, AttributeError) as e:
+            print(
+                f"Warning: inotify unavailable ({e}); "
+                f"polling {HOME_DIR} every {PROJECT_POLL_INTERVAL:g}s"
+            )
+            if inotify is not None:
+                inotify.close()
+            inotify = None
+
+    update_project_index(await asyncio.to_thread(scan_home))
+    if inotify is not None:
+        asyncio.get_running_loop().add_reader(inotify.fd, read_project_events)
+    spawn_background(project_index_loop())
+
+
+def stop_project_index() -> None:
+    global inotify
+    if inotify is not None:
+        asyncio.get_running_loop().remove_reader(inotify.fd)
+        inotify.close()
+        inotify = None
+
+
+async def find_project(project_name: str) -> ProjectEntry:
+    """Return a project's index entry, or raise 404.
+
+    Misses are confirmed on disk (in a worker thread), so a directory created
+    a moment ago is found even before its notification is processed.
+    """
+    entry = project_index.get(project_name)
+    if entry is None:
+        entry = await asyncio.to_thread(scan_project, project_name)
+        if entry is not None:
+            update_project_index({project_name: entry})
+    if entry is None:
+        raise HTTPException(
+            status_code=404, detail=f"Project not found: {project_name}"
+        )
+    return entry
+
+
+def project_info(
+    entry: ProjectEntry, is_running: bool, address: Optional[Address]
+) -> Project:
+    return Project(
+        name=entry.name,
+        path=str(entry.path),
+        has_git=entry.has_git,
+        has_package_json=entry.has_package_json,
+        is_running=is_running,
+        port=address if isinstance(address, int) else None,
+        socket=address if isinstance(address, str) else None,
+        state=get_instance_state(entry.name),
+        resources=latest_resources(entry.name) if is_running else None,
+        metadata=project_metadata.get(entry.name),
+    )
+
+
+# =============================================================================
+# Usage History & Pre-warming
+# =============================================================================
+
+# Usage history: project_name -> activity timestamps (oldest first)
+usage_history: dict[str, list[float]] = {}
+
+USAGE_HISTORY_LIMIT = 500  # Entries kept per project
+USAGE_RECORD_INTERVAL = 60.0  # Bursts of activity count once per minute
+WARMUP_MIN_SCORE = 1.0  # Roughly "used around this hour recently"
+
+# Read-mostly endpoints fetched once so a warmed instance answers them hot
+WARMUP_PREFETCH_PATHS = ("config/providers", "agent", "command")
+
+# Ready state reason of instances the warm-up started
+WARMUP_REASON = "Pre-warmed"
+
+
+def record_usage(project_name: str) -> None:
+    """Record activity on a project for the warm-up policy."""
+    now = time.time()
+    events = usage_history.setdefault(project_name, [])
+    if events and now - events[-1] < USAGE_RECORD_INTERVAL:
+        return
+
+    publish_change("usage", project_name, now)
+    apply_usage(project_name, now)
+
+
+def apply_usage(project_name: str, ts: float) -> None:
+    events = usage_history.setdefault(project_name, [])
+    events.append(ts)
+    if len(events) > USAGE_HISTORY_LIMIT:
+        del events[: len(events) - USAGE_HISTORY_LIMIT]
+
+
+shared_state_handlers["usage"] = apply_usage
+
+
+def usage_score(project_name: str, at: float) -> float:
+    """Score how likely a project is to be used at a given time.
+
+    Every past use counts, decayed by age (recency) and weighted up when it
+    happened around the same hour of day (daily routine).
+    """
+    target_hour = time.localtime(at).tm_hour
+    score = 0.0
+    for ts in usage_history.get(project_name, ()):
+        age_days = max(0.0, at - ts) / 86400
+        recency = 0.5 ** (age_days / USAGE_HALF_LIFE_DAYS)
+        hour_gap = abs(time.localtime(ts).tm_hour - target_hour)
+        hour_gap = min(hour_gap, 24 - hour_gap)
+        score += recency * (1.0 if hour_gap <= 1 else 0.25)
+    return score
+
+
+def predict_projects(limit: int) -> list[str]:
+    """Return the projects most likely to be opened within the lookahead."""
+    at = time.time() + WARMUP_LOOKAHEAD
+    scored = [
+        (usage_score(name, at), name) for name in usage_history if name in project_index
+    ]
+    scored.sort(reverse=True)
+    return [name for score, name in scored[:limit] if score >= WARMUP_MIN_SCORE]
+
+
+def unused_warm_instances() -> list[InstanceInfo]:
+    """Ready instances the warm-up started that nobody has used since.
+
+    Both instance states and usage history are shared, so any worker's
+    answer is the same.
+    """
+    unused = []
+    for instance in instances.values():
+        if instance.state != InstanceState.READY or instance.reason != WARMUP_REASON:
+            continue
+        events = usage_history.get(instance.name)
+        if events and events[-1] >= (instance.started_at or instance.since):
+            continue
+        unused.append(instance)
+    return unused
+
+
+async def prewarm_project(project_name: str) -> None:
+    """Start a project and fetch its read-mostly endpoints once."""
+    await launch_instance(project_name, reason=WARMUP_REASON)
+    address = get_ready_address(project_name)
+    if not address:
+        return
+    client, base_url = upstream(address)
+    for path in WARMUP_PREFETCH_PATHS:
+        try:
+            await client.get(f"{base_url}/{path}", timeout=30.0)
+        except httpx.HTTPError:
+            pass
+
+
+async def stop_idle_warm_instances() -> None:
+    """Stop pre-warmed instances that went unused for WARMUP_IDLE_TIMEOUT."""
+    now = time.time()
+    for instance in unused_warm_instances():
+        if now - instance.since < WARMUP_IDLE_TIMEOUT:
+            continue
+        print(f"Stopping unused pre-warmed {instance.name}")
+        try:
+            await stop_project(instance.name)
+        except HTTPException as e:
+            print(f"Warning: Failed to stop {instance.name}: {e.detail}")
+
+
+async def run_warmup() -> None:
+    """Pre-start predicted projects without exceeding the instance budget.
+
+    Pre-warmed instances nobody has used yet count against WARMUP_TOP_N, so
+    mispredictions do not pile up between passes.
+    """
+    await stop_idle_warm_instances()
+    budget = min(
+        MAX_INSTANCES - count_active_instances(),
+        WARMUP_TOP_N - len(unused_warm_instances()),
+    )
+    for project_name in predict_projects(WARMUP_TOP_N):
+        if budget <= 0:
+            break
+        if get_instance_state(project_name) in ACTIVE_STATES:
+            continue
+
+        is_running, address = await get_service_status(project_name)
+        if is_running and address:
+            continue
+
+        budget -= 1
+        print(f"Pre-warming {project_name}")
+        try:
+            await prewarm_project(project_name)
+        except HTTPException as e:
+            print(f"Warning: Failed to pre-warm {project_name}: {e.detail}")
+
+
+async def warmup_loop() -> None:
+    """Periodically persist usage history and pre-warm likely projects."""
+    while True:
+        try:
+            await asyncio.to_thread(save_state, "usage.json", usage_history)
+            if WARMUP_TOP_N > 0:
+                await run_warmup()
+        except Exception as e:
+            print(f"Warning: Warm-up failed: {e}")
+        await asyncio.sleep(WARMUP_INTERVAL)
+
+
+# =============================================================================
+# Resource Telemetry
+# =============================================================================
+
+# Recent cgroup samples: project_name -> time series (oldest first)
+resource_samples: dict[str, deque[ResourceSample]] = {}
+
+# Resolved cgroup directories: service name -> path
+cgroup_paths: dict[str, Path] = {}
+
+
+def find_cgroup_dir(service: str) -> Optional[Path]:
+    """Locate the cgroup v2 directory of a user service."""
+    cached = cgroup_paths.get(service)
+    if cached is not None and cached.is_dir():
+        return cached
+
+    unit = f"{service}.service"
+    template = service.split("@", 1)[0]
+    candidates = [
+        CGROUP_ROOT / "app.slice" / f"app-{template}.slice" / unit,
+        CGROUP_ROOT / "app.slice" / unit,
+        CGROUP_ROOT / unit,
+    ]
+    for path in candidates:
+        if path.is_dir():
+            cgroup_paths[service] = path
+            return path
+
+    cgroup_paths.pop(service, None)
+    return None
+
+
+def read_cgroup_int(path: Path) -> Optional[int]:
+    """Read a single-value cgroup file ("max" and missing files are None)."""
+    try:
+        value = path.read_text().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def read_cgroup_sample(
+    service: str, previous: Optional[ResourceSample]
+) -> Optional[ResourceSample]:
+    """Read the current resource usage of a service from its cgroup files."""
+    cgroup_dir = find_cgroup_dir(service)
+    if cgroup_dir is None:
+        return None
+
+    memory_current = read_cgroup_int(cgroup_dir / "memory.current")
+    if memory_current is None:
+        return None
+
+    cpu_usage_usec = 0
+    try:
+        for line in (cgroup_dir / "cpu.stat").read_text().splitlines():
+            key, _, value = line.partition(" ")
+            if key == "usage_usec":
+                cpu_usage_usec = int(value)
+                break
+    except (OSError, ValueError):
+        pass
+
+    now = time.time()
+    cpu_percent = None
+    if previous is not None and now > previous.timestamp:
+        cpu_delta = cpu_usage_usec - previous.cpu_usage_usec
+        if cpu_delta >= 0:
+            elapsed_usec = (now - previous.timestamp) * 1_000_000
+            cpu_percent = round(100.0 * cpu_delta / elapsed_usec, 1)
+
+    return ResourceSample(
+        timestamp=now,
+        memory_current=memory_current,
+        memory_peak=read_cgroup_int(cgroup_dir / "memory.peak"),
+        cpu_usage_usec=cpu_usage_usec,
+        cpu_percent=cpu_percent,
+        pids_current=read_cgroup_int(cgroup_dir / "pids.current"),
+    )
+
+
+def sample_resources(project_names: list[str]) -> None:
+    """Append one sample per project to its time series."""
+    for project_name in project_names:
+        series = resource_samples.get(project_name)
+        previous = series[-1] if series else None
+        sample = read_cgroup_sample(get_service_name(project_name), previous)
+        if sample is None:
+            continue
+        if series is None:
+            series = resource_samples[project_name] = deque(maxlen=TELEMETRY_HISTORY)
+        series.append(sample)
+
+
+def latest_resources(project_name: str) -> Optional[ResourceSample]:
+    """Most recent resource sample for a project, if any."""
+    series = resource_samples.get(project_name)
+    return series[-1] if series else None
+
+
+async def telemetry_loop() -> None:
+    """Sample cgroup usage of every running instance on an interval."""
+    while True:
+        try:
+            # cgroupfs reads are cheap but still blocking file I/O
+            ready = [
+                name
+                for name, instance in instances.items()
+                if instance.state in ACTIVE_STATES
+            ]
+            await asyncio.to_thread(sample_resources, ready)
+        except Exception as e:
+            print(f"Warning: Resource sampling failed: {e}")
+        await asyncio.sleep(TELEMETRY_INTERVAL)
+
+
+# =============================================================================
+# Draining
+# =============================================================================
+
+# Projects whose open SSE streams should end (after a final event)
+closing_streams: set[str] = set()
+
+# In-flight proxied requests and open SSE streams: project_name -> count
+inflight_requests: dict[str, int] = {}
+open_streams: dict[str, int] = {}
+
+# What other workers reported during a drain: project_name -> worker -> counts
+drain_activity: dict[str, dict[str, dict]] = {}
+
+DRAIN_POLL_INTERVAL = 0.5
+DRAIN_TIMEOUT_MAX = max(600.0, DRAIN_TIMEOUT)  # A stop holds the project lock
+
+SSE_SUBSCRIBERS = Gauge(
+    "gateway_sse_subscribers",
+    "Open proxied SSE streams.",
+    ("project",),
+    collect=lambda: {(name,): count for name, count in open_streams.items()},
+)
+
+
+def set_closing_streams(project_name: str, closing: bool) -> None:
+    """End (or stop ending) a project's open SSE streams in every worker."""
+    apply_closing_streams(project_name, closing)
+    publish_change("streams", project_name, closing)
+
+
+def apply_closing_streams(project_name: str, closing: bool) -> None:
+    if closing:
+        closing_streams.add(project_name)
+    else:
+        closing_streams.discard(project_name)
+
+
+shared_state_handlers["streams"] = apply_closing_streams
+
+
+async def report_drain_activity(project_name: str) -> None:
+    """Tell the draining worker what this worker still has open, until stopped.
+
+    The first report (even of nothing) acknowledges the drain.
+    """
+    reported = None
+    while get_instance_state(project_name) == InstanceState.DRAINING:
+        activity = {
+            "worker": worker_id,
+            "inflight": inflight_requests.get(project_name, 0),
+            "streams": open_streams.get(project_name, 0),
+        }
+        if activity != reported:
+            publish_change("activity", project_name, activity)
+            reported = activity
+        await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+
+def apply_drain_activity(project_name: str, activity: dict) -> None:
+    drain_activity.setdefault(project_name, {})[activity["worker"]] = activity
+
+
+shared_state_handlers["activity"] = apply_drain_activity
+
+
+async def other_workers_activity(project_name: str, since: float) -> tuple:
+    """Sum what other workers have open: (inflight, streams, unacknowledged).
+
+    Only workers that were alive when the drain began take part; one that
+    has not reported yet counts as unacknowledged.
+    """
+    if not sharing_state():
+        return 0, 0, 0
+    workers = await asyncio.get_running_loop().run_in_executor(
+        shared_state_executor, read_other_workers, since
+    )
+    reports = drain_activity.get(project_name, {})
+    inflight = streams = unacknowledged = 0
+    for worker in workers:
+        activity = reports.get(worker)
+        if activity is None:
+            unacknowledged += 1
+            continue
+        inflight += activity["inflight"]
+        streams += activity["streams"]
+    return inflight, streams, unacknowledged
+
+
+def drain_event(project_name: str) -> bytes:
+    """Final SSE event sent on streams closed by a drain."""
+    event = {"type": "gateway.instance.stopping", "properties": {"name": project_name}}
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+async def has_busy_sessions(project_name: str, address: Address) -> bool:
+    """Check whether any session of an instance is still processing."""
+    client, base_url = upstream(address)
+    try:
+        resp = await client.get(f"{base_url}/session/status", timeout=5.0)
+        resp.raise_for_status()
+        statuses = resp.json()
+        if not isinstance(statuses, dict):
+            raise ValueError("not an object")
+    except httpx.TransportError:
+        # Unreachable instance: nothing left to wait for
+        return False
+    except (httpx.HTTPError, ValueError):
+        # No usable /session/status (older OpenCode): go by the events
+        return sessions_seen_busy(project_name)
+
+    return any(
+        isinstance(status, dict) and status.get("type") != "idle"
+        for status in statuses.values()
+    )
+
+
+async def drain_instance(project_name: str, address: Address, timeout: float) -> bool:
+    """Wait for a draining instance to go quiet before it is stopped.
+
+    New proxied requests are refused while draining. Busy sessions get until
+    the deadline to reach idle and in-flight requests to finish; then open SSE
+    streams are ended with a final event. Returns True if everything finished
+    before the deadline.
+
+    With several workers, each one reports its own requests and streams (see
+    report_drain_activity) and the drain waits for all of them.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    since = time.time()
+    drain_activity.pop(project_name, None)
+
+    try:
+        # Let running prompts finish while streams keep delivering their events
+        while loop.time() < deadline:
+            busy = await has_busy_sessions(project_name, address)
+            inflight, _, unacknowledged = await other_workers_activity(
+                project_name, since
+            )
+            inflight += inflight_requests.get(project_name, 0)
+            if not busy and not inflight and not unacknowledged:
+                break
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+        # Streams end at their next chunk (OpenCode sends a heartbeat every ~10s)
+        set_closing_streams(project_name, True)
+        while loop.time() < deadline:
+            inflight, streams, unacknowledged = await other_workers_activity(
+                project_name, since
+            )
+            inflight += inflight_requests.get(project_name, 0)
+            streams += open_streams.get(project_name, 0)
+            if not inflight and not streams and not unacknowledged:
+                return True
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+        return False
+    finally:
+        drain_activity.pop(project_name, None)
+
+
+# =============================================================================
+# Instance Event Watchers
+# =============================================================================
+
+# One gateway-owned upstream /event subscription per instance
+event_watchers: dict[str, asyncio.Task] = {}
+
+# Set once a watcher's stream is connected: project_name -> event
+event_watchers_connected: dict[str, asyncio.Event] = {}
+
+# Called with (project_name, event) for every event an instance emits
+event_listeners: list = []
+
+EVENT_WATCHER_CONNECT_TIMEOUT = 2.0
+
+
+async def watch_instance_events(
+    project_name: str, address: Address, connected: asyncio.Event
+) -> None:
+    """Read an instance's event stream and hand each event to the listeners."""
+    client, base_url = upstream(address)
+    try:
+        async with client.stream(
+            "GET", f"{base_url}/event", timeout=httpx.Timeout(None, connect=5.0)
+        ) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                try:
+                    event = json.loads(line[5:])
+                except ValueError:
+                    continue
+                if event.get("type") == "server.connected":
+                    connected.set()
+                for listener in event_listeners:
+                    try:
+                        listener(project_name, event)
+                    except Exception as e:
+                        print(f"Warning: Event listener failed: {e}")
+    except httpx.HTTPError:
+        pass
+    finally:
+        if event_watchers.get(project_name) is asyncio.current_task():
+            event_watchers.pop(project_name, None)
+            event_watchers_connected.pop(project_name, None)
+            release_event_writer(project_name)
+
+
+async def ensure_event_watcher(project_name: str, address: Address) -> None:
+    """Make sure an instance's events are being watched.
+
+    Waits briefly for a new watcher to connect so the events caused by the
+    request about to be proxied are not missed.
+    """
+    if project_name not in event_watchers:
+        connected = asyncio.Event()
+        event_watchers_connected[project_name] = connected
+        event_watchers[project_name] = spawn_background(
+            watch_instance_events(project_name, address, connected)
+        )
+
+    try:
+        await asyncio.wait_for(
+            event_watchers_connected[project_name].wait(),
+            timeout=EVENT_WATCHER_CONNECT_TIMEOUT,
+        )
+    except (asyncio.TimeoutError, KeyError):
+        pass
+
+
+def stop_event_watcher(project_name: str) -> None:
+    """Stop watching an instance's events."""
+    task = event_watchers.pop(project_name, None)
+    event_watchers_connected.pop(project_name, None)
+    release_event_writer(project_name)
+    if task is not None:
+        task.cancel()
+
+
+# Sessions an instance's events last showed working: project_name -> ids
+busy_sessions: dict[str, set[str]] = {}
+
+
+def track_session_activity(project_name: str, event: dict) -> None:
+    """Follow which sessions are working, for instances without /session/status."""
+    event_type = event.get("type")
+    properties = event.get("properties") or {}
+    session_id = properties.get("sessionID")
+    if not session_id or event_type not in ("session.status", "session.idle"):
+        return
+
+    sessions = busy_sessions.setdefault(project_name, set())
+    status = (properties.get("status") or {}).get("type")
+    if event_type == "session.status" and status != "idle":
+        sessions.add(session_id)
+    else:
+        sessions.discard(session_id)
+    if not sessions:
+        del busy_sessions[project_name]
+
+
+event_listeners.append(track_session_activity)
+
+
+def sessions_seen_busy(project_name: str) -> bool:
+    """Whether the events (or prompts sent without a session.idle yet) say busy."""
+    return bool(busy_sessions.get(project_name)) or any(
+        name == project_name for name, _ in pending_generations
+    )
+
+
+# =============================================================================
+# Event Channels
+# =============================================================================
+
+# /ws carries instance events down and commands up over one WebSocket. The
+# frame encoding is negotiated as a subprotocol: name -> (encode, decode,
+# binary frames). Binary encodings are offered when their package is there.
+CHANNEL_ENCODINGS: dict[str, tuple[Callable, Callable, bool]] = {
+    "json": (lambda m: json.dumps(m, separators=(",", ":")), json.loads, False)
+}
+try:
+    import msgpack
+except ImportError:
+    pass
+else:
+    CHANNEL_ENCODINGS["msgpack"] = (msgpack.packb, msgpack.unpackb, True)
+try:
+    import cbor2
+except ImportError:
+    pass
+else:
+    CHANNEL_ENCODINGS["cbor"] = (cbor2.dumps, cbor2.loads, True)
+
+# Messages queued for one channel before it is closed as too slow
+CHANNEL_QUEUE_SIZE = 1000
+CHANNEL_CLOSE_TOO_SLOW = 1013  # "Try Again Later"
+
+# Open channels, and the ones subscribed to each project's events
+event_channels: set["EventChannel"] = set()
+channel_subscribers: dict[str, set["EventChannel"]] = {}
+
+EVENT_CHANNELS = Gauge(
+    "gateway_event_channels",
+    "Open /ws event channels.",
+    collect=lambda: {(): len(event_channels)},
+)
+
+
+@dataclass(eq=False)
+class EventChannel:
+    """One /ws connection: what it sends and which projects it follows."""
+
+    websocket: WebSocket
+    encoding: str
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    projects: set[str] = field(default_factory=set)
+    commands: set[asyncio.Task] = field(default_factory=set)
+    overflowed: bool = False
+
+    def push(self, message: dict) -> None:
+        if self.queue.qsize() >= CHANNEL_QUEUE_SIZE:
+            self.overflowed = True
+            return
+        self.queue.put_nowait(message)
+
+
+def forward_to_channels(project_name: str, event: dict) -> None:
+    for channel in channel_subscribers.get(project_name, ()):
+        channel.push({**event, "project": project_name})
+
+
+event_listeners.append(forward_to_channels)
+
+
+def unsubscribe_channel(channel: EventChannel, project_name: str) -> None:
+    channel.projects.discard(project_name)
+    subscribers = channel_subscribers.get(project_name)
+    if subscribers is not None:
+        subscribers.discard(channel)
+        if not subscribers:
+            del channel_subscribers[project_name]
+
+
+async def channel_sender(channel: EventChannel) -> None:
+    """Write queued messages to the socket, with heartbeats when idle."""
+    encode, _, binary = CHANNEL_ENCODINGS[channel.encoding]
+    while not channel.overflowed:
+        try:
+            message = await asyncio.wait_for(
+                channel.queue.get(), timeout=INSTANCE_EVENTS_HEARTBEAT
+            )
+        except asyncio.TimeoutError:
+            message = {"type": "server.heartbeat", "properties": {}}
+
+        # A followed instance (re)started: watch its events at the new address
+        if message.get("type") == "instance.state":
+            properties = message["properties"]
+            address = get_ready_address(properties["name"])
+            if properties["name"] in channel.projects and address:
+                spawn_background(ensure_event_watcher(properties["name"], address))
+
+        data = encode(message)
+        if binary:
+            await channel.websocket.send_bytes(data)
+        else:
+            await channel.websocket.send_text(data)
+
+    await channel.websocket.close(
+        code=CHANNEL_CLOSE_TOO_SLOW, reason="Events not read fast enough"
+    )
+
+
+def command_field(message: dict, name: str) -> str:
+    value = message.get(name)
+    if not isinstance(value, str) or not value:
+        raise HTTPException(status_code=400, detail=f"Missing field: {name}")
+    return value
+
+
+async def forward_command(
+    project_name: str, path: str, body: bytes, generation_session: str = ""
+) -> dict:
+    """POST a command to an instance the way the proxy would."""
+    address = await find_instance(project_name)
+    record_usage(project_name)
+
+    generation_key = None
+    if generation_session:
+        await ensure_event_watcher(project_name, address)
+        generation_key = begin_generation(project_name, generation_session, body)
+
+    client, base_url = upstream(address)
+    inflight_requests[project_name] = inflight_requests.get(project_name, 0) + 1
+    try:
+        response = await client.post(
+            f"{base_url}/{path}",
+            content=body,
+            headers={"content-type": "application/json"},
+        )
+    except httpx.HTTPError as e:
+        if generation_key:
+            cancel_generation(generation_key)
+        if isinstance(e, httpx.ConnectError):
+            forget_address(project_name, address)
+            raise HTTPException(
+                status_code=503,
+                detail="Cannot connect to OpenCode instance on "
+                + describe_address(address),
+            )
+        raise HTTPException(status_code=502, detail=f"Proxy error: {str(e)}")
+    finally:
+        inflight_requests[project_name] -= 1
+
+    if generation_key and response.status_code >= 400:
+        cancel_generation(generation_key)
+    try:
+        body = response.json() if response.content else None
+    except ValueError:
+        body = response.text
+    return {"status": response.status_code, "body": body}
+
+
+async def channel_subscribe(channel: EventChannel, message: dict) -> dict:
+    """Follow a project's events; they start flowing once it is running."""
+    project_name = command_field(message, "project")
+    await find_project(project_name)
+    channel.projects.add(project_name)
+    channel_subscribers.setdefault(project_name, set()).add(channel)
+
+    address = get_ready_address(project_name)
+    if address is None:
+        is_running, address = await get_service_status(project_name)
+        if not is_running:
+            address = None
+    if address:
+        await ensure_event_watcher(project_name, address)
+    return {"status": 200, "body": {"running": bool(address)}}
+
+
+async def channel_unsubscribe(channel: EventChannel, message: dict) -> dict:
+    unsubscribe_channel(channel, command_field(message, "project"))
+    return {"status": 200, "body": None}
+
+
+async def channel_prompt(channel: EventChannel, message: dict) -> dict:
+    """prompt_async on a session; the reply streams in as events."""
+    project_name = command_field(message, "project")
+    session_id = command_field(message, "session")
+    body = json.dumps(message.get("body") or {}).encode()
+    return await forward_command(
+        project_name,
+        f"session/{quote(session_id, safe='')}/prompt_async",
+        body,
+        generation_session=session_id,
+    )
+
+
+async def channel_abort(channel: EventChannel, message: dict) -> dict:
+    project_name = command_field(message, "project")
+    session_id = command_field(message, "session")
+    return await forward_command(
+        project_name, f"session/{quote(session_id, safe='')}/abort", b""
+    )
+
+
+# Command type -> handler(channel, message) returning the reply fields
+CHANNEL_COMMANDS = {
+    "subscribe": channel_subscribe,
+    "unsubscribe": channel_unsubscribe,
+    "prompt": channel_prompt,
+    "abort": channel_abort,
+}
+
+
+async def run_channel_command(channel: EventChannel, message) -> None:
+    """Run one command and queue its reply (or error) under the command's id."""
+    command_id = message.get("id") if isinstance(message, dict) else None
+    try:
+        if not isinstance(message, dict):
+            raise HTTPException(status_code=400, detail="Commands must be objects")
+        handler = CHANNEL_COMMANDS.get(message.get("type"))
+        if handler is None:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown command: {message.get('type')}"
+            )
+        reply = {"type": "reply", "id": command_id, **await handler(channel, message)}
+    except HTTPException as e:
+        reply = {
+            "type": "error",
+            "id": command_id,
+            "status": e.status_code,
+            "detail": e.detail,
+        }
+    except Exception as e:
+        reply = {"type": "error", "id": command_id, "status": 500, "detail": str(e)}
+    channel.push(reply)
+
+
+# =============================================================================
+# Event Buffers
+# =============================================================================
+
+# Recent events of every watched instance, so a client that was away (an app
+# in the background) catches up with one request instead of a stream and a
+# full reload. Sequence numbers count per buffer; a cursor names the buffer
+# (epoch) and the last sequence number the client has.
+#
+# With several workers, one per project (holding its events lock) fills the
+# buffer from its watcher and shares every addition; the others mirror it, so
+# a poll may land on any worker.
+LONG_POLL_TIMEOUT = 25.0
+LONG_POLL_MAX = 60.0
+EVENT_BATCH_MAX = 1000
+EVENT_WRITER_RETRY = 1.0  # Seconds between tries to take over a project's buffer
+
+# Not worth keeping: the stream's own keep-alives
+UNBUFFERED_EVENTS = {"server.heartbeat", "server.connected"}
+
+
+@dataclass
+class EventBuffer:
+    epoch: str
+    events: deque = field(default_factory=lambda: deque(maxlen=EVENT_BUFFER_SIZE))
+    next_seq: int = 1
+    # First sequence number of the current watcher's stream; earlier cursors
+    # may have missed events while nothing was watching
+    watched_from: int = 1
+    watched: bool = False
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+event_buffers: dict[str, EventBuffer] = {}
+
+# Projects whose buffer this worker fills: project_name -> events lock fd
+event_writer_locks: dict[str, int] = {}
+event_writer_attempts: dict[str, float] = {}
+
+EVENT_BUFFER_EVENTS = Gauge(
+    "gateway_event_buffer_events",
+    "Events held in the long-poll buffers.",
+    collect=lambda: {(): sum(len(b.events) for b in event_buffers.values())},
+)
+
+
+def get_event_buffer(project_name: str) -> EventBuffer:
+    buffer = event_buffers.get(project_name)
+    if buffer is None:
+        buffer = event_buffers[project_name] = EventBuffer(
+            epoch=f"{worker_id}-{time.time_ns()}"
+        )
+    return buffer
+
+
+def wake_event_buffer(buffer: EventBuffer) -> None:
+    """Wake the long polls waiting on a buffer."""
+    buffer.changed.set()
+    buffer.changed = asyncio.Event()
+
+
+def take_event_writer(project_name: str) -> bool:
+    """Try (at most every EVENT_WRITER_RETRY) to become a buffer's writer."""
+    now = time.monotonic()
+    if now - event_writer_attempts.get(project_name, 0.0) < EVENT_WRITER_RETRY:
+        return False
+    event_writer_attempts[project_name] = now
+
+    name = sanitize_project_name(project_name)
+    fd = os.open(
+        STATE_DIR / "locks" / f"{name}.events.lock", os.O_RDWR | os.O_CREAT, 0o600
+    )
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    event_writer_locks[project_name] = fd
+    return True
+
+
+def release_event_writer(project_name: str) -> None:
+    """Let another worker's watcher fill the buffer (ours stopped)."""
+    fd = event_writer_locks.pop(project_name, None)
+    if fd is not None:
+        os.close(fd)
+
+
+def buffer_event(project_name: str, event: dict) -> None:
+    watching = event.get("type") == "server.connected"
+    if sharing_state() and project_name not in event_writer_locks:
+        if not take_event_writer(project_name):
+            return
+        # Only the worker that started a buffer numbers its events: numbering
+        # on from a mirror could reuse numbers not applied here yet
+        buffer = event_buffers.get(project_name)
+        if buffer is not None and not buffer.epoch.startswith(f"{worker_id}-"):
+            # Polls waiting on the old buffer reset onto the new one
+            del event_buffers[project_name]
+            wake_event_buffer(buffer)
+        watching = True
+
+    buffer = get_event_buffer(project_name)
+    if watching:
+        # A new stream: whatever happened since the last one is unknown,
+        # which takes up one sequence number
+        if buffer.watched:
+            buffer.next_seq += 1
+        buffer.watched = True
+        buffer.watched_from = buffer.next_seq
+        share_buffered_event(project_name, buffer, None)
+    if event.get("type") in UNBUFFERED_EVENTS:
+        return
+
+    item = (buffer.next_seq, event)
+    buffer.events.append(item)
+    buffer.next_seq += 1
+    wake_event_buffer(buffer)
+    share_buffered_event(project_name, buffer, item)
+
+
+event_listeners.append(buffer_event)
+
+
+def share_buffered_event(
+    project_name: str, buffer: EventBuffer, item: Optional[tuple]
+) -> None:
+    """Send an addition (or just the new watch) to the other workers' mirrors."""
+    if not (sharing_state() and other_workers):
+        return
+    seq, event = item or (None, None)
+    publish_change(
+        "event",
+        project_name,
+        {
+            "epoch": buffer.epoch,
+            "next_seq": buffer.next_seq,
+            "watched_from": buffer.watched_from,
+            "seq": seq,
+            "event": event,
+        },
+    )
+
+
+def apply_buffered_event(project_name: str, data: dict) -> None:
+    """Mirror an addition to the writer's buffer."""
+    if project_name in event_writer_locks:
+        # Left over from the previous writer; this worker numbers anew
+        return
+    buffer = event_buffers.get(project_name)
+    if buffer is None or buffer.epoch != data["epoch"]:
+        if buffer is not None:
+            # Polls waiting on the old buffer reset onto the new one
+            wake_event_buffer(buffer)
+        buffer = event_buffers[project_name] = EventBuffer(epoch=data["epoch"])
+    buffer.watched = True
+    buffer.watched_from = data["watched_from"]
+    buffer.next_seq = data["next_seq"]
+    if data["seq"] is not None:
+        buffer.events.append((data["seq"], data["event"]))
+    wake_event_buffer(buffer)
+
+
+shared_state_handlers["event"] = apply_buffered_event
+
+
+def buffered_since(buffer: EventBuffer, seq: int) -> Optional[list[tuple]]:
+    """Buffered events after a sequence number, or None if some are gone."""
+    oldest = buffer.events[0][0] if buffer.events else buffer.next_seq
+    if seq + 1 < max(oldest, buffer.watched_from) or seq >= buffer.next_seq:
+        return None
+    return [(s, event) for s, event in buffer.events if s > seq]
+
+
+# =============================================================================
+# Project Metadata
+# =============================================================================
+
+METADATA_DELAY = 2.0  # Coalesce bursts of changes (an agent editing many files)
+METADATA_GIT_TIMEOUT = 10.0
+METADATA_MAX_FILES = 200_000  # Size walks stop here and report a lower bound
+
+# Marker files in a project root -> toolchain, in display order
+TOOLCHAIN_MARKERS = (
+    ("package.json", "node"),
+    ("bun.lockb", "bun"),
+    ("deno.json", "deno"),
+    ("pyproject.toml", "python"),
+    ("requirements.txt", "python"),
+    ("setup.py", "python"),
+    ("Cargo.toml", "rust"),
+    ("go.mod", "go"),
+    ("Package.swift", "swift"),
+    ("Gemfile", "ruby"),
+    ("pom.xml", "java"),
+    ("build.gradle", "java"),
+    ("build.gradle.kts", "kotlin"),
+    ("composer.json", "php"),
+    ("mix.exs", "elixir"),
+    ("CMakeLists.txt", "c++"),
+    ("Makefile", "make"),
+    ("Dockerfile", "docker"),
+)
+
+# Cached metadata: project_name -> last collected metadata
+project_metadata: dict[str, ProjectMetadata] = {}
+
+# Projects whose metadata is out of date: all of it, or only what git and
+# the project root tell (cheap enough to refresh on every change)
+stale_metadata: set[str] = set()
+stale_git_metadata: set[str] = set()
+metadata_wakeup = asyncio.Event()
+
+metadata_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=METADATA_WORKERS, thread_name_prefix="metadata"
+)
+
+
+def run_git(path: Path, *args: str) -> Optional[str]:
+    """Output of a git command in a project, or None if git fails."""
+    # The gateway may run as another user than the owner of the repositories
+    # (root in the Docker image), which git refuses as "dubious ownership"
+    try:
+        result = subprocess.run(
+            [
+                "git",
+                "-c",
+                "safe.directory=*",
+                "--no-optional-locks",
+                "-C",
+                str(path),
+                *args,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=METADATA_GIT_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def read_git_branch(path: Path) -> Optional[str]:
+    """Current branch from .git/HEAD (short commit id when detached)."""
+    git_dir = path / ".git"
+    try:
+        if git_dir.is_file():
+            # Worktree or submodule: "gitdir: <path>"
+            git_dir = (path / git_dir.read_text().split(":", 1)[1].strip()).resolve()
+        head = (git_dir / "HEAD").read_text().strip()
+    except (OSError, IndexError):
+        return None
+    if head.startswith("ref: refs/heads/"):
+        return head.removeprefix("ref: refs/heads/")
+    return head[:12]
+
+
+def measure_tree(path: Path) -> tuple[int, Optional[float], bool]:
+    """Total file size, newest mtime outside .git, and whether the walk finished."""
+    size = 0
+    newest = None
+    files = 0
+    pending = [(path, False)]
+    while pending:
+        directory, in_git = pending.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(
+                        (
+                            entry.path,
+                            in_git or (directory == path and entry.name == ".git"),
+                        )
+                    )
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            size += stat.st_size
+            if not in_git and (newest is None or stat.st_mtime > newest):
+                newest = stat.st_mtime
+            files += 1
+            if files >= METADATA_MAX_FILES:
+                return size, newest, False
+    return size, newest, True
+
+
+def newest_root_mtime(path: Path) -> Optional[float]:
+    """Newest mtime among the entries of a project root (not recursive)."""
+    newest = None
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return None
+    for entry in entries:
+        if entry.name == ".git":
+            continue
+        try:
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except OSError:
+            continue
+        if newest is None or mtime > newest:
+            newest = mtime
+    return newest
+
+
+def collect_git_metadata(entry: ProjectEntry, metadata: ProjectMetadata) -> None:
+    """Fill in toolchains and git state (blocking, but cheap)."""
+    path = entry.path
+    metadata.toolchains = list(
+        dict.fromkeys(
+            toolchain
+            for marker, toolchain in TOOLCHAIN_MARKERS
+            if (path / marker).exists()
+        )
+    )
+    if entry.has_git:
+        metadata.branch = read_git_branch(path)
+        status = run_git(path, "status", "--porcelain", "--untracked-files=normal")
+        if status is not None:
+            metadata.dirty = bool(status.strip())
+        last_commit = run_git(path, "log", "-1", "--format=%ct")
+        if last_commit and last_commit.strip().isdigit():
+            metadata.last_commit_at = float(last_commit)
+
+
+def collect_metadata(entry: ProjectEntry) -> ProjectMetadata:
+    """Compute a project's metadata (blocking; runs in the metadata pool)."""
+    size, modified_at, complete = measure_tree(entry.path)
+    metadata = ProjectMetadata(
+        modified_at=modified_at,
+        size_bytes=size,
+        size_complete=complete,
+        collected_at=time.time(),
+    )
+    collect_git_metadata(entry, metadata)
+    return metadata
+
+
+def refresh_metadata(entry: ProjectEntry, previous: ProjectMetadata) -> ProjectMetadata:
+    """Update git state and toolchains, keeping the size of the last full walk.
+
+    modified_at only moves forward from the project root's own entries; the
+    periodic full walk catches up on deeper files.
+    """
+    metadata = previous.model_copy()
+    collect_git_metadata(entry, metadata)
+    newest = newest_root_mtime(entry.path)
+    if newest is not None and (metadata.modified_at or 0.0) < newest:
+        metadata.modified_at = newest
+    return metadata
+
+
+def invalidate_metadata(project_name: str, *_) -> None:
+    """Mark a project's metadata for full recollection."""
+    stale_metadata.add(project_name)
+    metadata_wakeup.set()
+
+
+def invalidate_git_metadata(project_name: str, *_) -> None:
+    """Mark a project's git state and toolchains for refreshing."""
+    stale_git_metadata.add(project_name)
+    metadata_wakeup.set()
+
+
+def track_file_events(project_name: str, event: dict) -> None:
+    """Refresh after OpenCode edits files or finishes a generation."""
+    if event.get("type") in ("file.edited", "session.idle"):
+        invalidate_git_metadata(project_name)
+
+
+async def metadata_loop() -> None:
+    """Recollect stale metadata in the pool, and everything periodically."""
+    loop = asyncio.get_running_loop()
+    stale_metadata.update(project_index)
+    metadata_wakeup.set()
+    while True:
+        try:
+            await asyncio.wait_for(
+                metadata_wakeup.wait(), timeout=METADATA_REFRESH_INTERVAL
+            )
+            await asyncio.sleep(METADATA_DELAY)
+        except asyncio.TimeoutError:
+            stale_metadata.update(project_index)
+        metadata_wakeup.clear()
+
+        names = set(stale_metadata)
+        stale_metadata.clear()
+        # Never collected: nothing to refresh, so walk the tree
+        names.update(
+            name for name in stale_git_metadata if name not in project_metadata
+        )
+        refreshed = stale_git_metadata - names
+        stale_git_metadata.clear()
+        for name in (names | refreshed) - project_index.keys():
+            project_metadata.pop(name, None)
+        names &= project_index.keys()
+        refreshed &= project_index.keys()
+
+        collected = [project_index[name] for name in names]
+        updated = [project_index[name] for name in refreshed]
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(metadata_executor, collect_metadata, entry)
+                for entry in collected
+            ),
+            *(
+                loop.run_in_executor(
+                    metadata_executor,
+                    refresh_metadata,
+                    entry,
+                    project_metadata[entry.name],
+                )
+                for entry in updated
+            ),
+            return_exceptions=True,
+        )
+        entries = collected + updated
+        for entry, result in zip(entries, results):
+            if isinstance(result, Exception):
+                print(f"Warning: Failed to collect metadata for {entry.name}: {result}")
+            elif project_index.get(entry.name) is not None:
+                project_metadata[entry.name] = result
+
+
+project_index_listeners.append(invalidate_metadata)
+project_change_listeners.append(invalidate_git_metadata)
+event_listeners.append(track_file_events)
+
+
+# =============================================================================
+# Project Listing
+# =============================================================================
+
+PROJECT_SORTS = ("name", "recent", "resources")
+PROJECT_PAGE_MAX = 500
+
+
+def last_activity(project_name: str) -> float:
+    """Newest of last use through the gateway, last file change, last commit."""
+    times = [0.0]
+    if usage_history.get(project_name):
+        times.append(usage_history[project_name][-1])
+    metadata = project_metadata.get(project_name)
+    if metadata is not None:
+        times += [metadata.modified_at or 0.0, metadata.last_commit_at or 0.0]
+    return max(times)
+
+
+def project_sort_key(sort: str, name: str) -> tuple:
+    """Ascending sort key; the name last keeps keys unique for cursors."""
+    if sort == "recent":
+        return (-last_activity(name), name.lower(), name)
+    if sort == "resources":
+        sample = None
+        if get_instance_state(name) in ACTIVE_STATES:
+            sample = latest_resources(name)
+        memory = (sample.memory_current or 0) if sample else 0
+        cpu = (sample.cpu_percent or 0.0) if sample else 0.0
+        return (-memory, -cpu, name.lower(), name)
+    return (name.lower(), name)
+
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    data = json.dumps([sort, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """Sort key a cursor points after (400 if it is invalid or for another sort)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort or not isinstance(key, list):
+            raise ValueError
+        return tuple(key)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# =============================================================================
+# Generation Performance
+# =============================================================================
+
+PROMPT_ASYNC_PATH = re.compile(r"^session/([^/]+)/prompt_async$")
+
+GENERATION_TIMEOUT = 600.0  # Forget prompts that never reach session.idle
+GENERATION_SAMPLES = 200  # Recent generations kept per model for percentiles
+
+GENERATION_TTFT = Histogram(
+    "gateway_generation_ttft_seconds",
+    "Time from prompt_async to the first assistant part.",
+    ("provider", "model"),
+)
+GENERATION_DURATION = Histogram(
+    "gateway_generation_duration_seconds",
+    "Time from prompt_async to session.idle.",
+    ("provider", "model"),
+)
+GENERATION_OUTPUT_CHARS = Counter(
+    "gateway_generation_output_chars_total",
+    "Characters of assistant output streamed.",
+    ("provider", "model"),
+)
+GENERATIONS_TOTAL = Counter(
+    "gateway_generations_total",
+    "Prompts that ran to session.idle.",
+    ("provider", "model", "outcome"),
+)
+
+
+@dataclass
+class Generation:
+    """A prompt being followed through an instance's event stream."""
+
+    provider_id: str
+    model_id: str
+    sent_at: float
+    first_part_at: Optional[float] = None
+    last_part_at: Optional[float] = None
+    output_chars: int = 0
+    output_tokens: Optional[int] = None
+    failed: bool = False
+    message_ids: set = field(default_factory=set)
+    part_lengths: dict = field(default_factory=dict)
+
+
+@dataclass
+class ModelStats:
+    """Recent generation results for one provider/model."""
+
+    generations: int = 0
+    errors: int = 0
+    ttft: deque = field(default_factory=lambda: deque(maxlen=GENERATION_SAMPLES))
+    duration: deque = field(default_factory=lambda: deque(maxlen=GENERATION_SAMPLES))
+    chars_per_second: deque = field(
+        default_factory=lambda: deque(maxlen=GENERATION_SAMPLES)
+    )
+    tokens_per_second: deque = field(
+        default_factory=lambda: deque(maxlen=GENERATION_SAMPLES)
+    )
+
+
+# Prompts awaiting session.idle: (project_name, session_id) -> generation
+pending_generations: dict[tuple[str, str], Generation] = {}
+
+# Aggregated results: (provider_id, model_id) -> stats
+model_stats: dict[tuple[str, str], ModelStats] = {}
+
+
+def percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank percentile of a sequence (None if empty)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def begin_generation(project_name: str, session_id: str, body: bytes) -> tuple:
+    """Start following a prompt_async request."""
+    now = time.monotonic()
+    for key, generation in list(pending_generations.items()):
+        if now - generation.sent_at > GENERATION_TIMEOUT:
+            del pending_generations[key]
+
+    model = {}
+    try:
+        model = json.loads(body).get("model") or {}
+    except (ValueError, AttributeError):
+        pass
+
+    key = (project_name, session_id)
+    pending_generations[key] = Generation(
+        provider_id=str(model.get("providerID", "unknown")),
+        model_id=str(model.get("modelID", "unknown")),
+        sent_at=now,
+    )
+    return key
+
+
+def cancel_generation(key: tuple) -> None:
+    """Stop following a prompt that was rejected upstream."""
+    pending_generations.pop(key, None)
+
+
+def finish_generation(generation: Generation, now: float) -> None:
+    """Fold a completed generation into the per-model statistics."""
+    labels = (generation.provider_id, generation.model_id)
+    stats = model_stats.setdefault(labels, ModelStats())
+    stats.generations += 1
+    if generation.failed:
+        stats.errors += 1
+
+    duration = now - generation.sent_at
+    stats.duration.append(duration)
+    GENERATION_DURATION.observe(labels, duration)
+    GENERATIONS_TOTAL.inc(labels + ("error" if generation.failed else "ok",))
+    GENERATION_OUTPUT_CHARS.inc(labels, generation.output_chars)
+
+    if generation.first_part_at is None:
+        return
+    ttft = generation.first_part_at - generation.sent_at
+    stats.ttft.append(ttft)
+    GENERATION_TTFT.observe(labels, ttft)
+
+    streaming = (generation.last_part_at or now) - generation.first_part_at
+    if streaming > 0:
+        stats.chars_per_second.append(generation.output_chars / streaming)
+        if generation.output_tokens:
+            stats.tokens_per_second.append(generation.output_tokens / streaming)
+
+
+def track_generation_event(project_name: str, event: dict) -> None:
+    """Follow pending prompts through an instance's events."""
+    if not pending_generations:
+        return
+
+    event_type = event.get("type")
+    properties = event.get("properties") or {}
+
+    if event_type == "message.updated":
+        info = properties.get("info") or {}
+        generation = pending_generations.get((project_name, info.get("sessionID")))
+        if generation is None or info.get("role") != "assistant":
+            return
+        generation.message_ids.add(info.get("id"))
+        # The instance knows which model actually answered
+        generation.provider_id = info.get("providerID") or generation.provider_id
+        generation.model_id = info.get("modelID") or generation.model_id
+        if info.get("error"):
+            generation.failed = True
+        tokens = (info.get("tokens") or {}).get("output")
+        if tokens:
+            generation.output_tokens = tokens
+
+    elif event_type == "message.part.updated":
+        part = properties.get("part") or {}
+        generation = pending_generations.get((project_name, part.get("sessionID")))
+        if generation is None or part.get("messageID") not in generation.message_ids:
+            return
+        now = time.monotonic()
+        if generation.first_part_at is None:
+            generation.first_part_at = now
+        generation.last_part_at = now
+
+        # Parts are re-sent whole; count only what is new
+        text = part.get("text") or ""
+        previous = generation.part_lengths.get(part.get("id"), 0)
+        if len(text) > previous:
+            generation.output_chars += len(text) - previous
+            generation.part_lengths[part.get("id")] = len(text)
+
+    elif event_type == "session.error":
+        generation = pending_generations.get(
+            (project_name, properties.get("sessionID"))
+        )
+        if generation is not None:
+            generation.failed = True
+
+    elif event_type == "session.idle":
+        generation = pending_generations.pop(
+            (project_name, properties.get("sessionID")), None
+        )
+        if generation is not None:
+            finish_generation(generation, time.monotonic())
+
+
+event_listeners.append(track_generation_event)
+
+
+# =============================================================================
+# Event Loop Monitor
+# =============================================================================
+
+LOOP_LAG_INTERVAL = 0.25  # Seconds between lag samples
+LOOP_LAG_SAMPLES = 240  # One minute of samples
+LOOP_STALLS_KEPT = 50
+LOOP_STACK_DEPTH = 40
+
+# Recent lag samples in seconds (oldest first)
+loop_lag_samples: deque[float] = deque(maxlen=LOOP_LAG_SAMPLES)
+
+# Recent stalls with the stack that was running when they were caught
+loop_stalls: deque[LoopStall] = deque(maxlen=LOOP_STALLS_KEPT)
+
+# Tells the watchdog thread to exit
+loop_watchdog_stop = threading.Event()
+
+LOOP_LAG = Histogram(
+    "gateway_event_loop_lag_seconds",
+    "Delay of a timer callback beyond its scheduled time.",
+)
+LOOP_STALLS = Counter(
+    "gateway_event_loop_stalls_total",
+    "Times the event loop did not respond within LOOP_SLOW_CALLBACK_MS.",
+)
+ASYNCIO_TASKS = Gauge(
+    "gateway_asyncio_tasks",
+    "Asyncio tasks alive on the event loop.",
+    collect=lambda: {(): len(asyncio.all_tasks())},
+)
+
+
+async def loop_lag_sampler() -> None:
+    """Measure how late the loop runs a timer that should fire on schedule."""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - scheduled)
+        loop_lag_samples.append(lag)
+        LOOP_LAG.observe((), lag)
+
+
+def record_loop_stall(at: float, duration: float, stack: list[str]) -> None:
+    """Store a stall caught by the watchdog (runs on the loop)."""
+    LOOP_STALLS.inc()
+    loop_stalls.append(
+        LoopStall(at=at, duration_ms=round(duration * 1000, 1), stack=stack)
+    )
+
+
+def loop_watchdog(loop: asyncio.AbstractEventLoop, loop_thread_id: int) -> None:
+    """Ping the loop from a thread; capture its stack when it does not answer.
+
+    A callback that blocks the loop for longer than LOOP_SLOW_CALLBACK_MS is
+    still on the loop thread's stack when the ping times out, so the captured
+    stack points at the code that blocks (e.g. synchronous file I/O).
+    """
+    threshold = LOOP_SLOW_CALLBACK_MS / 1000
+    while not loop_watchdog_stop.is_set():
+        answered = threading.Event()
+        pinged_at = time.time()
+        pinged = time.monotonic()
+        try:
+            loop.call_soon_threadsafe(answered.set)
+        except RuntimeError:
+            return  # Loop closed
+
+        if answered.wait(threshold):
+            loop_watchdog_stop.wait(threshold)
+            continue
+
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = []
+        if frame is not None:
+            stack = [
+                f"{f.filename}:{f.lineno} in {f.name}: {f.line}"
+                for f in traceback.extract_stack(frame)[-LOOP_STACK_DEPTH:]
+            ]
+        del frame
+
+        while not answered.wait(1.0):
+            if loop_watchdog_stop.is_set():
+                return
+        duration = time.monotonic() - pinged
+        try:
+            loop.call_soon_threadsafe(record_loop_stall, pinged_at, duration, stack)
+        except RuntimeError:
+            return
+
+
+def start_loop_monitor() -> None:
+    """Start the lag sampler task and the watchdog thread."""
+    loop_watchdog_stop.clear()
+    spawn_background(loop_lag_sampler())
+    threading.Thread(
+        target=loop_watchdog,
+        args=(asyncio.get_running_loop(), threading.get_ident()),
+        name="loop-watchdog",
+        daemon=True,
+    ).start()
+
+
+# =============================================================================
+# Profiling
+# =============================================================================
+
+PROFILE_MODES = ("sampling", "cprofile")
+PROFILE_FORMATS = {"sampling": ("collapsed",), "cprofile": ("text", "pstats")}
+PROFILE_TEXT_LINES = 60
+
+# Only one profile runs at a time; nothing is installed while this is free
+profile_lock = asyncio.Lock()
+
+
+def frame_label(code) -> str:
+    """Frame name used in collapsed stacks."""
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def sample_threads(stop: threading.Event, interval: float, counts: dict) -> None:
+    """Collect the stack of every thread (except this one) until stopped."""
+    me = threading.get_ident()
+    while not stop.wait(interval):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(f"thread:{names.get(ident, ident)}")
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+
+
+def coroutine_stack(coro) -> list[str]:
+    """Frames of a suspended coroutine, following what it awaits (outermost first)."""
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(frame_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+
+async def sample_tasks(interval: float, counts: dict) -> None:
+    """Collect where every other asyncio task is suspended, on the loop."""
+    me = asyncio.current_task()
+    while True:
+        await asyncio.sleep(interval)
+        for task in asyncio.all_tasks():
+            if task is me or task.done():
+                continue
+            stack = ["task"] + coroutine_stack(task.get_coro())
+            key = ";".join(stack)
+            counts[key] = counts.get(key, 0) + 1
+
+
+async def profile_sampling(seconds: float, interval: float) -> str:
+    """Sample thread stacks (on-CPU work) and task stacks (awaits) for a while.
+
+    Returns collapsed stacks ("frame;frame;frame count" per line), the input
+    format of flamegraph.pl and speedscope.
+    """
+    thread_counts: dict[str, int] = {}
+    task_counts: dict[str, int] = {}
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=sample_threads,
+        args=(stop, interval, thread_counts),
+        name="profile-sampler",
+        daemon=True,
+    )
+    sampler.start()
+    tasks_sampler = asyncio.create_task(sample_tasks(interval, task_counts))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        tasks_sampler.cancel()
+        await asyncio.to_thread(sampler.join)
+
+    counts = {**thread_counts, **task_counts}
+    return "".join(
+        f"{stack} {count}\n"
+        for stack, count in sorted(counts.items(), key=lambda item: -item[1])
+    )
+
+
+async def profile_cprofile(seconds: float) -> cProfile.Profile:
+    """Trace every call made on the event loop thread for a while.
+
+    All coroutines and callbacks run on the loop thread, so the profile covers
+    every request handled during the window. Work in worker threads
+    (asyncio.to_thread) is not traced.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    return profiler
+
+
+# =============================================================================
+# Endpoints
+# =============================================================================
+
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint (no auth required)."""
+    return {"status": "ok", "service": "viberemote-gateway"}
+
+
+@app.get("/ready")
+async def readiness(response: Response) -> Readiness:
+    """Readiness: 503 until the instance registry has been validated."""
+    ready = registry_validation["done"]
+    if not ready:
+        response.status_code = 503
+    return Readiness(
+        ready=ready,
+        instances_registered=registry_validation["registered"],
+        instances_validated=registry_validation["validated"],
+    )
+
+
+@app.get("/projects", dependencies=[Depends(verify_auth)])
+async def list_projects(
+    response: Response,
+    prefix: Optional[str] = None,
+    q: Optional[str] = None,
+    running_only: bool = False,
+    sort: str = "name",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> list[Project]:
+    """List projects in the home directory (from the project index).
+
+    Everything is served from memory: filters, sorting and pagination from
+    the project index, is_running and addresses from the instance states
+    (which the reconcile loop keeps in line with systemd). With limit, the
+    cursor of the next page is returned in the X-Next-Cursor header.
+    """
+    if sort not in PROJECT_SORTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sort '{sort}' (expected one of {', '.join(PROJECT_SORTS)})",
+        )
+    if limit is not None and not 1 <= limit <= PROJECT_PAGE_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {PROJECT_PAGE_MAX}"
+        )
+
+    names = list(project_index)
+    if prefix:
+        names = [n for n in names if n.lower().startswith(prefix.lower())]
+    if q:
+        names = [n for n in names if q.lower() in n.lower()]
+    if running_only:
+        names = [n for n in names if get_instance_state(n) in ACTIVE_STATES]
+
+    keyed = sorted((project_sort_key(sort, n), n) for n in names)
+    start = 0
+    if cursor:
+        after = decode_cursor(cursor, sort)
+        try:
+            start = bisect.bisect_right(keyed, (after, "\uffff"))
+        except TypeError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    end = len(keyed) if limit is None else start + limit
+    page = keyed[start:end]
+
+    response.headers["X-Total-Count"] = str(len(keyed))
+    if end < len(keyed):
+        response.headers["X-Next-Cursor"] = encode_cursor(sort, page[-1][0])
+
+    return [
+        project_info(project_index[name], *known_service_status(name))
+        for _, name in page
+    ]
+
+
+@app.post("/projects/{project_name}/start", dependencies=[Depends(verify_auth)])
+async def start_project(project_name: str) -> StartResponse:
+    """Start an OpenCode instance for a project."""
+    await find_project(project_name)
+
+    record_usage(project_name)
+    return await launch_instance(project_name)
+
+
+@app.delete("/projects/{project_name}/stop", dependencies=[Depends(verify_auth)])
+async def stop_project(
+    project_name: str, drain: bool = True, timeout: float = DRAIN_TIMEOUT
+) -> StopResponse:
+    """Stop an OpenCode instance for a project.
+
+    By default the instance is drained first (see drain_instance) for up to
+    timeout seconds; pass drain=false to stop immediately.
+    """
+    if not 0 <= timeout <= DRAIN_TIMEOUT_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"timeout must be between 0 and {DRAIN_TIMEOUT_MAX:g}",
+        )
+
+    # Queue behind a start (or another stop) in progress
+    async with project_lock(project_name):
+        drained = False
+        address = get_ready_address(project_name)
+        if get_instance_state(project_name) == InstanceState.STARTING:
+            # Holding the lock, so no start owns it: left behind by a crash
+            set_instance_state(
+                project_name, InstanceState.FAILED, reason="Interrupted start"
+            )
+        if get_instance_state(project_name) != InstanceState.STOPPED:
+            set_instance_state(project_name, InstanceState.DRAINING, address=address)
+
+        try:
+            if drain and address:
+                drained = await drain_instance(project_name, address, timeout)
+
+            service = get_service_name(project_name)
+            returncode, stdout, stderr = await run_systemctl("stop", service)
+        except BaseException as e:
+            # Never leave the instance in DRAINING: nothing would own it
+            if get_instance_state(project_name) == InstanceState.DRAINING:
+                set_instance_state(
+                    project_name,
+                    InstanceState.FAILED,
+                    reason=f"Stop interrupted: {e!r}",
+                )
+            raise
+        finally:
+            set_closing_streams(project_name, False)
+            stop_event_watcher(project_name)
+
+        if returncode != 0:
+            set_instance_state(
+                project_name, InstanceState.FAILED, reason=stderr or stdout
+            )
+            raise HTTPException(
+                status_code=500, detail=f"Failed to stop service: {stderr or stdout}"
+            )
+
+        if get_instance_state(project_name) != InstanceState.STOPPED:
+            set_instance_state(project_name, InstanceState.STOPPED)
+
+    return StopResponse(name=project_name, status="stopped", drained=drained)
+
+
+@app.get("/projects/{project_name}/status", dependencies=[Depends(verify_auth)])
+async def project_status(project_name: str) -> Project:
+    """Get status of a specific project."""
+    entry = await find_project(project_name)
+    is_running, address = await get_service_status(project_name)
+    return project_info(entry, is_running, address)
+
+
+@app.get("/instances", dependencies=[Depends(verify_auth)])
+async def list_instances() -> list[InstanceInfo]:
+    """List the lifecycle state of every known instance."""
+    return sorted(instances.values(), key=lambda i: i.name.lower())
+
+
+@app.get("/instances/events", dependencies=[Depends(verify_auth)])
+async def instance_events() -> StreamingResponse:
+    """Stream instance state transitions (SSE), starting with a snapshot."""
+    queue: asyncio.Queue = asyncio.Queue()
+    instance_subscribers.add(queue)
+
+    async def stream_events():
+        try:
+            for instance in list(instances.values()):
+                event = {
+                    "type": "instance.state",
+                    "properties": instance.model_dump(mode="json"),
+                }
+                yield f"data: {json.dumps(event)}\n\n".encode()
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=INSTANCE_EVENTS_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    event = {"type": "server.heartbeat", "properties": {}}
+                yield f"data: {json.dumps(event)}\n\n".encode()
+        finally:
+            instance_subscribers.discard(queue)
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        # No Connection header: it is invalid in HTTP/2
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/projects/{project_name}/events", dependencies=[Depends(verify_auth)])
+async def poll_events(
+    project_name: str,
+    cursor: Optional[str] = None,
+    timeout: float = LONG_POLL_TIMEOUT,
+    limit: int = EVENT_BATCH_MAX,
+) -> EventBatch:
+    """Events of a project's instance after a cursor (long polling).
+
+    Waits up to timeout seconds when there are none yet. Without a cursor,
+    returns the current one and no events: load the history, then poll from
+    there. reset means events after the cursor were lost (evicted, not
+    watched, or the buffer was started anew); reload and continue from the
+    returned cursor.
+    """
+    await find_project(project_name)
+    if not 0 <= timeout <= LONG_POLL_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"timeout must be between 0 and {LONG_POLL_MAX:g}"
+        )
+    if not 1 <= limit <= EVENT_BATCH_MAX:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {EVENT_BATCH_MAX}"
+        )
+
+    # Keep the instance's events flowing into its buffer
+    address = get_ready_address(project_name)
+    if address:
+        await ensure_event_watcher(project_name, address)
+    buffer = get_event_buffer(project_name)
+    head = encode_cursor("events", (buffer.epoch, buffer.next_seq - 1))
+    if cursor is None:
+        return EventBatch(cursor=head, events=[])
+
+    key = decode_cursor(cursor, "events")
+    if len(key) != 2 or not isinstance(key[1], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    epoch, seq = key
+    if epoch != buffer.epoch:
+        return EventBatch(cursor=head, events=[], reset=True)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        if event_buffers.get(project_name) is not buffer:
+            # Started anew (another writer took over) while waiting
+            buffer = get_event_buffer(project_name)
+            pending = None
+        else:
+            pending = buffered_since(buffer, seq)
+        if pending is None:
+            head = encode_cursor("events", (buffer.epoch, buffer.next_seq - 1))
+            return EventBatch(cursor=head, events=[], reset=True)
+        remaining = deadline - time.monotonic()
+        if pending or remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(buffer.changed.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+    batch = pending[:limit]
+    if batch:
+        seq = batch[-1][0]
+    return EventBatch(
+        cursor=encode_cursor("events", (buffer.epoch, seq)),
+        events=[event for _, event in batch],
+        more=len(pending) > limit,
+    )
+
+
+@app.websocket("/ws")
+async def event_channel(websocket: WebSocket) -> None:
+    """Instance events down, commands up, over one WebSocket.
+
+    Starts with a snapshot of instance states like /instances/events; events
+    of the projects the client subscribed to follow, tagged with "project".
+    Every command gets a reply or error carrying its "id".
+    """
+    error = auth_error(websocket.headers.get("authorization", ""))
+    if error:
+        await websocket.close(code=1008, reason=error)
+        return
+
+    offered = websocket.scope.get("subprotocols", [])
+    encoding = next((p for p in offered if p in CHANNEL_ENCODINGS), None)
+    await websocket.accept(subprotocol=encoding)
+    channel = EventChannel(websocket, encoding or "json")
+    _, decode, _ = CHANNEL_ENCODINGS[channel.encoding]
+
+    for instance in list(instances.values()):
+        channel.push(
+            {"type": "instance.state", "properties": instance.model_dump(mode="json")}
+        )
+    event_channels.add(channel)
+
+    async def receive_commands() -> None:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            try:
+                if frame.get("text") is not None:
+                    message = json.loads(frame["text"])
+                else:
+                    message = decode(frame["bytes"])
+            except Exception:
+                message = None
+            task = asyncio.create_task(run_channel_command(channel, message))
+            channel.commands.add(task)
+            task.add_done_callback(channel.commands.discard)
+
+    sender = asyncio.create_task(channel_sender(channel))
+    receiver = asyncio.create_task(receive_commands())
+    try:
+        # Either side ending ends the connection
+        done, _ = await asyncio.wait(
+            {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+        )
+        error = sender.exception() if sender in done else None
+        if error is not None and not isinstance(error, WebSocketDisconnect):
+            print(f"Warning: Event channel failed: {error!r}")
+            with contextlib.suppress(Exception):
+                await websocket.close(code=1011, reason="Internal error")
+        if receiver in done:
+            receiver.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_channels.discard(channel)
+        for project_name in list(channel.projects):
+            unsubscribe_channel(channel, project_name)
+        sender.cancel()
+        receiver.cancel()
+        for task in list(channel.commands):
+            task.cancel()
+
+
+@app.get("/projects/{project_name}/resources", dependencies=[Depends(verify_auth)])
+async def project_resources(project_name: str) -> ResourceHistory:
+    """Get the recent resource usage time series of a project's instance."""
+    await find_project(project_name)
+
+    return ResourceHistory(
+        name=project_name, samples=list(resource_samples.get(project_name, ()))
+    )
+
+
+@app.get("/projects/{project_name}/limits", dependencies=[Depends(verify_auth)])
+async def get_project_limits(project_name: str) -> ResourceLimits:
+    """Get the resource overrides of a project (unset fields use the template)."""
+    await find_project(project_name)
+
+    return get_resource_limits(project_name) or ResourceLimits()
+
+
+@app.put("/projects/{project_name}/limits", dependencies=[Depends(verify_auth)])
+async def set_project_limits(
+    project_name: str, limits: ResourceLimits
+) -> ResourceLimits:
+    """Set resource overrides, applying them immediately if the instance runs."""
+    await find_project(project_name)
+
+    service = get_service_name(project_name)
+    overrides = limits.model_dump(exclude_none=True)
+    previous = resource_limits.get(project_name, {})
+
+    # set-property also works on stopped units, so apply unconditionally
+    returncode, stdout, stderr = await apply_resource_limits(service, limits)
+    if returncode != 0:
+        # Nothing changed; the stored overrides still match the unit
+        raise HTTPException(
+            status_code=500, detail=f"Failed to apply limits: {stderr or stdout}"
+        )
+
+    # Overrides are replaced as a whole: drop properties that are no longer set
+    dropped = previous.keys() - overrides.keys()
+    returncode, stdout, stderr = await clear_resource_limits(service, dropped)
+    if returncode != 0:
+        # The dropped properties are still in effect: record them as such
+        await record_resource_limits(
+            project_name,
+            {**{field: previous[field] for field in dropped}, **overrides},
+        )
+        raise HTTPException(
+            status_code=500, detail=f"Failed to reset limits: {stderr or stdout}"
+        )
+
+    await record_resource_limits(project_name, overrides)
+    return limits
+
+
+@app.delete("/projects/{project_name}/limits", dependencies=[Depends(verify_auth)])
+async def reset_project_limits(project_name: str) -> ResourceLimits:
+    """Drop resource overrides and return the unit to its template limits."""
+    await find_project(project_name)
+
+    service = get_service_name(project_name)
+    returncode, stdout, stderr = await clear_resource_limits(
+        service, resource_limits.get(project_name, {}).keys()
+    )
+    if returncode != 0:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to reset limits: {stderr or stdout}"
+        )
+
+    await record_resource_limits(project_name, {})
+    return ResourceLimits()
+
+
+# The proxy is served by proxy_request (see ProxyFastPath) rather than a
+# FastAPI route: it is most of the traffic and needs none of the framework.
+PROXY_PATH = re.compile(r"^/projects/([^/]+)/api/(.*)$", re.DOTALL)
+PROXY_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"}
+
+# Stands in for the matched route in the ASGI scope (metrics and access log)
+PROXY_ROUTE = SimpleNamespace(path="/projects/{project_name}/api/{path:path}")
+
+# Not forwarded in either direction; the ASGI server and httpx frame the body
+HOP_BY_HOP_HEADERS = {
+    b"connection",
+    b"keep-alive",
+    b"proxy-connection",
+    b"transfer-encoding",
+    b"upgrade",
+    b"te",
+    b"trailer",
+}
+REQUEST_HEADERS_DROPPED = HOP_BY_HOP_HEADERS | {b"host", b"authorization"}
+# The ASGI server adds its own
+RESPONSE_HEADERS_DROPPED = HOP_BY_HOP_HEADERS | {b"date", b"server"}
+
+# Pooled keep-alive connections to the instances: one client for TCP
+# loopback (created at startup) and one per Unix socket (on first use)
+upstream_client: Optional[httpx.AsyncClient] = None
+socket_clients: dict[str, httpx.AsyncClient] = {}
+UPSTREAM_KEEPALIVE = 100
+
+# Connection setup as reported by httpcore's trace extension
+CONNECT_STARTED_EVENTS = {
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+}
+CONNECT_COMPLETE_EVENTS = {
+    "connection.connect_tcp.complete",
+    "connection.connect_unix_socket.complete",
+}
+
+
+def open_upstream_client(uds: Optional[str] = None) -> httpx.AsyncClient:
+    # No connection limit: every open SSE stream holds one connection
+    limits = httpx.Limits(
+        max_connections=None, max_keepalive_connections=UPSTREAM_KEEPALIVE
+    )
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(uds=uds, limits=limits), timeout=60.0
+    )
+
+
+def upstream(address: Address) -> tuple[httpx.AsyncClient, str]:
+    """Pooled client and base URL for an instance address."""
+    if isinstance(address, int):
+        return upstream_client, f"http://127.0.0.1:{address}"
+    client = socket_clients.get(address)
+    if client is None:
+        client = socket_clients[address] = open_upstream_client(uds=address)
+    return client, "http://localhost"
+
+
+async def send_error(
+    send, status_code: int, detail: str, headers: Optional[dict] = None
+) -> None:
+    """Send an error the way FastAPI renders an HTTPException."""
+    body = json.dumps({"detail": detail}, separators=(",", ":")).encode()
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    raw_headers += [
+        (k.lower().encode(), v.encode()) for k, v in (headers or {}).items()
+    ]
+    await send(
+        {"type": "http.response.start", "status": status_code, "headers": raw_headers}
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class ClientDisconnect(Exception):
+    """The client went away before its request body was complete."""
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnect
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+async def request_content(receive, project_name: str):
+    """The request body as bytes if it came in one piece, else as a stream.
+
+    A streamed body raises ClientDisconnect if the client goes away, which
+    aborts the upstream request instead of forwarding a truncated body.
+    """
+    message = await receive()
+    if message["type"] == "http.disconnect":
+        raise ClientDisconnect
+    first = message.get("body", b"")
+    PROXIED_BYTES.inc((project_name, "request"), len(first))
+    if not message.get("more_body", False):
+        return first
+
+    async def stream():
+        yield first
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect
+            chunk = message.get("body", b"")
+            PROXIED_BYTES.inc((project_name, "request"), len(chunk))
+            yield chunk
+            if not message.get("more_body", False):
+                return
+
+    return stream()
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def response_headers(response: httpx.Response) -> list[tuple[bytes, bytes]]:
+    return [
+        (name.lower(), value)
+        for name, value in response.headers.raw
+        if name.lower() not in RESPONSE_HEADERS_DROPPED
+    ]
+
+
+async def find_instance(project_name: str) -> Address:
+    """Address of the instance to forward a request to (503 if there is none)."""
+    if get_instance_state(project_name) == InstanceState.DRAINING:
+        raise HTTPException(
+            status_code=503,
+            detail=f"OpenCode instance for {project_name} is stopping.",
+            headers={"Retry-After": "5"},
+        )
+
+    # Ask systemd only if not known to be ready
+    address = get_ready_address(project_name)
+    if address is None:
+        is_running, address = await get_service_status(project_name)
+        if not is_running:
+            address = None
+
+    if not address:
+        raise HTTPException(
+            status_code=503,
+            detail=f"OpenCode instance for {project_name} is not running. "
+            "Start it first.",
+        )
+    return address
+
+
+def forget_address(project_name: str, address: Address) -> None:
+    """The address is stale (crash or restart): rediscover on next request."""
+    if get_ready_address(project_name) == address:
+        set_instance_state(
+            project_name,
+            InstanceState.FAILED,
+            reason=f"Cannot connect to {describe_address(address)}",
+        )
+
+
+async def proxy_request(scope, receive, send, project_name: str, path: str) -> None:
+    """Proxy a request to the project's OpenCode instance (raw ASGI)."""
+    scope["route"] = PROXY_ROUTE
+    scope["path_params"] = {"project_name": project_name, "path": path}
+
+    start = time.perf_counter()
+    authorization = ""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            authorization = value.decode("latin-1")
+            break
+    error = auth_error(authorization)
+    record_timing("auth", time.perf_counter() - start)
+    if error:
+        await send_error(send, 401, error)
+        return
+
+    method = scope["method"]
+    if method not in PROXY_METHODS:
+        await send_error(send, 405, "Method Not Allowed")
+        return
+
+    try:
+        address = await find_instance(project_name)
+    except HTTPException as e:
+        await send_error(send, e.status_code, e.detail, headers=e.headers)
+        return
+
+    record_usage(project_name)
+
+    client, base_url = upstream(address)
+    target_url = f"{base_url}/{path}"
+    if scope["query_string"]:
+        target_url += "?" + scope["query_string"].decode("latin-1")
+
+    # Forward headers (except Host and Authorization which we handle)
+    headers = [
+        (name, value)
+        for name, value in scope["headers"]
+        if name not in REQUEST_HEADERS_DROPPED
+    ]
+
+    # Check if this is an SSE request
+    accept = next((v for n, v in headers if n == b"accept"), b"")
+    if b"text/event-stream" in accept or path == "event":
+        try:
+            body = await read_body(receive)
+        except ClientDisconnect:
+            return
+        PROXIED_BYTES.inc((project_name, "request"), len(body))
+        await proxy_sse(
+            scope,
+            receive,
+            send,
+            project_name,
+            client,
+            method,
+            target_url,
+            headers,
+            body,
+        )
+        return
+
+    generation_key = None
+    prompt_match = PROMPT_ASYNC_PATH.match(path)
+
+    inflight_requests[project_name] = inflight_requests.get(project_name, 0) + 1
+    try:
+        connect_start = 0.0
+        connect_seconds = 0.0
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal connect_start, connect_seconds
+            if event_name in CONNECT_STARTED_EVENTS:
+                connect_start = time.perf_counter()
+            elif event_name in CONNECT_COMPLETE_EVENTS:
+                connect_seconds = time.perf_counter() - connect_start
+
+        try:
+            if prompt_match and method == "POST":
+                # Follow prompts through the event stream for TTFT/throughput
+                # stats; the model is read from the (small) body
+                content = await read_body(receive)
+                PROXIED_BYTES.inc((project_name, "request"), len(content))
+                await ensure_event_watcher(project_name, address)
+                generation_key = begin_generation(
+                    project_name, prompt_match.group(1), content
+                )
+            else:
+                content = await request_content(receive, project_name)
+
+            upstream_start = time.perf_counter()
+            response = await client.send(
+                client.build_request(
+                    method,
+                    target_url,
+                    headers=headers,
+                    content=content,
+                    extensions={"trace": trace},
+                ),
+                stream=True,
+            )
+            headers_received = time.perf_counter()
+        except ClientDisconnect:
+            # Nobody to answer, and nothing half-sent reaches OpenCode
+            if generation_key:
+                cancel_generation(generation_key)
+            return
+        except httpx.ConnectError:
+            if generation_key:
+                cancel_generation(generation_key)
+            forget_address(project_name, address)
+            await send_error(
+                send,
+                503,
+                f"Cannot connect to OpenCode instance on {describe_address(address)}",
+            )
+            return
+        except Exception as e:
+            if generation_key:
+                cancel_generation(generation_key)
+            await send_error(send, 502, f"Proxy error: {str(e)}")
+            return
+
+        record_timing("connect", connect_seconds)
+        record_timing("upstream", headers_received - upstream_start - connect_seconds)
+        if generation_key and response.status_code >= 400:
+            cancel_generation(generation_key)
+
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": response_headers(response),
+                }
+            )
+            # Raw (still encoded) bytes, so Content-Length and -Encoding hold
+            async for chunk in response.aiter_raw():
+                PROXIED_BYTES.inc((project_name, "response"), len(chunk))
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+        except httpx.HTTPError as e:
+            # Too late for an error response: the client sees the body cut off
+            print(f"Warning: Response from {project_name} broke off: {e}")
+            return
+        finally:
+            await response.aclose()
+            upstream_end = time.perf_counter()
+            record_timing("transfer", upstream_end - headers_received)
+            UPSTREAM_DURATION.observe((project_name,), upstream_end - upstream_start)
+    finally:
+        inflight_requests[project_name] -= 1
+
+
+async def proxy_sse(
+    scope,
+    receive,
+    send,
+    project_name: str,
+    client: httpx.AsyncClient,
+    method: str,
+    target_url: str,
+    headers: list,
+    body: bytes,
+) -> None:
+    """Relay an event stream chunk by chunk until either side goes away."""
+
+    async def relay() -> None:
+        started = False
+        try:
+            async with client.stream(
+                method, target_url, headers=headers, content=body, timeout=None
+            ) as response:
+                started = True
+                raw_headers = response_headers(response)
+                if "cache-control" not in response.headers:
+                    raw_headers.append((b"cache-control", b"no-cache"))
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": response.status_code,
+                        "headers": raw_headers,
+                    }
+                )
+                async for chunk in response.aiter_raw():
+                    PROXIED_BYTES.inc((project_name, "response"), len(chunk))
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+                    if project_name in closing_streams:
+                        break
+        except httpx.HTTPError as e:
+            print(f"SSE Stream Error: {e}")
+            if not started:
+                await send_error(send, 502, f"Proxy error: {str(e)}")
+                return
+
+        # Tell the client the stream ended on purpose
+        if get_instance_state(project_name) == InstanceState.DRAINING:
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": drain_event(project_name),
+                    "more_body": True,
+                }
+            )
+        await send({"type": "http.response.body", "body": b""})
+
+    open_streams[project_name] = open_streams.get(project_name, 0) + 1
+    relay_task = asyncio.ensure_future(relay())
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait(
+            {relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        open_streams[project_name] -= 1
+        for task in (relay_task, disconnect_task):
+            task.cancel()
+        await asyncio.gather(relay_task, disconnect_task, return_exceptions=True)
+    if relay_task in done:
+        relay_task.result()
+
+
+@app.get("/models/performance", dependencies=[Depends(verify_auth)])
+async def models_performance() -> list[ModelPerformance]:
+    """Time-to-first-token, duration and throughput per provider/model."""
+    results = [
+        ModelPerformance(
+            provider_id=provider_id,
+            model_id=model_id,
+            generations=stats.generations,
+            errors=stats.errors,
+            ttft_p50=percentile(stats.ttft, 0.5),
+            ttft_p95=percentile(stats.ttft, 0.95),
+            duration_p50=percentile(stats.duration, 0.5),
+            duration_p95=percentile(stats.duration, 0.95),
+            chars_per_second=percentile(stats.chars_per_second, 0.5),
+            tokens_per_second=percentile(stats.tokens_per_second, 0.5),
+        )
+        for (provider_id, model_id), stats in model_stats.items()
+    ]
+    results.sort(key=lambda r: r.generations, reverse=True)
+    return results
+
+
+@app.get("/admin/loop", dependencies=[Depends(verify_auth)])
+async def loop_status() -> LoopStatus:
+    """Event loop lag and recent stalls with the stacks that caused them."""
+    lags_ms = [lag * 1000 for lag in loop_lag_samples]
+    return LoopStatus(
+        lag_ms=lags_ms[-1] if lags_ms else None,
+        lag_p50_ms=percentile(lags_ms, 0.5),
+        lag_p99_ms=percentile(lags_ms, 0.99),
+        lag_max_ms=max(lags_ms, default=None),
+        slow_callback_threshold_ms=LOOP_SLOW_CALLBACK_MS,
+        stalls=list(reversed(loop_stalls)),
+    )
+
+
+@app.post("/admin/profile", dependencies=[Depends(verify_auth)])
+async def run_profile(
+    seconds: float = 10.0,
+    mode: str = "sampling",
+    format: Optional[str] = None,
+    interval_ms: float = 10.0,
+) -> Response:
+    """Profile the gateway for a number of seconds and return the result."""
+    if mode not in PROFILE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown mode '{mode}' (expected one of {', '.join(PROFILE_MODES)})",
+        )
+    format = format or PROFILE_FORMATS[mode][0]
+    if format not in PROFILE_FORMATS[mode]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format '{format}' is not available for mode '{mode}'",
+        )
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}",
+        )
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(
+            status_code=400, detail="interval_ms must be between 1 and 1000"
+        )
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    async with profile_lock:
+        if mode == "sampling":
+            collapsed = await profile_sampling(seconds, interval_ms / 1000)
+            return PlainTextResponse(collapsed)
+
+        profiler = await profile_cprofile(seconds)
+
+    if format == "pstats":
+        # Same bytes as Profile.dump_stats(); load with pstats.Stats(path)
+        profiler.create_stats()
+        return Response(
+            content=marshal.dumps(profiler.stats),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="gateway.pstats"'},
+        )
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TEXT_LINES)
+    return PlainTextResponse(report.getvalue())
+
+
+@app.get("/metrics", dependencies=[Depends(verify_auth)])
+async def metrics() -> PlainTextResponse:
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# =============================================================================
+# Startup
+# =============================================================================
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Load the instance registry and start background work."""
+    print(f"VibeRemote Gateway starting...")
+    print(f"Home directory: {HOME_DIR}")
+    print(
+        f"Auth secret configured: {'Yes' if AUTH_SECRET != 'change-me-in-production' else 'NO - USING DEFAULT!'}"
+    )
+
+    try:
+        registry = await asyncio.get_running_loop().run_in_executor(
+            shared_state_executor, open_shared_state
+        )
+        load_instance_registry(registry)
+        print(f"Loaded {len(registry)} instance(s) from the registry")
+        if SHARED_STATE:
+            spawn_background(shared_state_loop())
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warning: Instance registry unavailable, running standalone: {e}")
+
+    try:
+        await start_project_index()
+        print(f"Indexed {len(project_index)} project(s)")
+    except Exception as e:
+        print(f"Warning: Failed to index projects: {e}")
+
+    usage_history.update(load_state("usage.json") or {})
+    resource_limits.update(load_state("limits.json") or {})
+    global access_log_queue, upstream_client
+    upstream_client = open_upstream_client()
+    if ACCESS_LOG:
+        access_log_queue = asyncio.Queue(maxsize=ACCESS_LOG_QUEUE_SIZE)
+        spawn_background(access_log_writer())
+
+    if LOOP_MONITOR:
+        start_loop_monitor()
+
+    spawn_background(metadata_loop())
+    spawn_background(telemetry_loop())
+    spawn_background(leader_loop())
+    spawn_background(validate_registry())
+
+    print(
+        f"Gateway ready. Validating {count_active_instances()} running "
+        "instance(s) in the background."
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work and persist state."""
+    loop_watchdog_stop.set()
+    stop_project_index()
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if upstream_client is not None:
+        await upstream_client.aclose()
+    for client in socket_clients.values():
+        await client.aclose()
+    metadata_executor.shutdown(wait=False, cancel_futures=True)
+    if sharing_state():
+        shared_state_executor.submit(forget_worker)
+    # Let queued changes reach the other workers
+    shared_state_executor.shutdown(wait=True)
+
+    # Every worker holds the same merged history; one copy is enough
+    if is_leader:
+        save_state("usage.json", usage_history)
+
+
+def serve_hypercorn(host: str, port: int) -> bool:
+    """Serve HTTP/1.1 and HTTP/2 with hypercorn; False if it is not installed.
+
+    Each HTTP/2 stream has its own flow-control window, so an SSE stream a
+    client stops reading only holds back itself, not requests multiplexed
+    on the same connection.
+    """
+    try:
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+    except ImportError:
+        return False
+
+    import signal
+
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.accesslog = None  # Requests are logged by the gateway's own access log
+    config.h2_max_concurrent_streams = H2_MAX_CONCURRENT_STREAMS
+    if TLS_CERTFILE:
+        config.certfile = TLS_CERTFILE
+        config.keyfile = TLS_KEYFILE or None
+        config.alpn_protocols = ["h2", "http/1.1"]
+
+    async def run() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve(app, config, shutdown_trigger=stop.wait)
+
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run())
+    else:
+        uvloop.run(run())
+    return True
+
+
+if __name__ == "__main__":
+    if SERVER == "hypercorn":
+        if serve_hypercorn("0.0.0.0", 4000):
+            sys.exit(0)
+        print("Warning: hypercorn is not installed, serving HTTP/1.1 with uvicorn")
+
+    import uvicorn
+
+    # Requests are logged by the gateway's own access log
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=4000,
+        access_log=False,
+        ssl_certfile=TLS_CERTFILE or None,
+        ssl_keyfile=TLS_KEYFILE or None,
+    )
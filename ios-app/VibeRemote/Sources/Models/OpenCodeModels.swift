@@ -22,7 +22,8 @@ struct GatewayProject: Codable, Identifiable {
 
 struct GatewayStartResponse: Codable {
     let name: String
-    let port: Int
+    /// Nil when the instance listens on a Unix socket instead of a port
+    let port: Int?
     let status: String
 }
 
@@ -83,7 +83,7 @@ class ChatViewModel: ObservableObject {
             
             do {
                 let startResult = try await gatewayClient.startProject(session.projectName)
-                logger.info("OpenCode started/running on port \(startResult.port), status: \(startResult.status)")
+                logger.info("OpenCode started/running on port \(startResult.port.map(String.init) ?? "socket"), status: \(startResult.status)")
             } catch GatewayError.projectNotFound(let name) {
                 connectionState = .error("Project '\(name)' not found on server")
                 return
@@ -536,7 +536,7 @@ class ChatViewModel: ObservableObject {
             
             logger.info("Starting OpenCode for project: \(self.session.projectName)")
             let startResult = try await gatewayClient.startProject(session.projectName)
-            logger.info("OpenCode restarted on port \(startResult.port), status: \(startResult.status)")
+            logger.info("OpenCode restarted on port \(startResult.port.map(String.init) ?? "socket"), status: \(startResult.status)")
             
             try await Task.sleep(nanoseconds: 2_000_000_000)
             